@@ -0,0 +1,73 @@
+"""
+Scanning messages in joined batches against parsing them one by one.
+
+Parses `--messages` synthetic messages without fetching titles, once
+with `Handler.parse` per message and once with `Handler.scan_batch` over
+batches of each size, resolving the results the same way `parse` does.
+Reports messages per second for each, best of `--repeat` runs.
+
+Usage:
+  batch_scan [options]
+
+Options:
+  --messages=<n>  Messages to parse [default: 100000].
+  --sizes=<n,..>  Batch sizes [default: 10,100,1000,10000,100000].
+  --repeat=<n>    Runs of each [default: 3].
+  -h --help       Show this screen.
+"""
+from __future__ import print_function
+
+import time
+
+from docopt import docopt
+
+from chat_parser.handlers import Handler
+
+from .corpus import generate
+
+
+def best_rate(func, messages, repeat):
+    took = []
+    for i in range(repeat):
+        start = time.time()
+        func(messages)
+        took.append(time.time() - start)
+    return len(messages) / min(took)
+
+
+def parse_each(handler):
+    def run(messages):
+        return [handler.parse(message) for message in messages]
+    return run
+
+
+def parse_batches(handler, size):
+    def run(messages):
+        results = []
+        for start in range(0, len(messages), size):
+            batch = handler.scan_batch(messages[start:start + size])
+            results.extend(handler.resolve(data) for data in batch)
+        return results
+    return run
+
+
+def main():
+    args = docopt(__doc__)
+    messages = list(generate(int(args['--messages'])))
+    sizes = [int(size) for size in args['--sizes'].split(',')]
+    repeat = int(args['--repeat'])
+    handler = Handler(titles=False)
+
+    assert parse_batches(handler, sizes[0])(messages) == (
+        parse_each(handler)(messages))
+
+    each = best_rate(parse_each(handler), messages, repeat)
+    print('{:>10} {:>12} {:>8}'.format('batch', 'messages/s', 'speedup'))
+    print('{:>10} {:>12.0f} {:>8}'.format('each', each, ''))
+    for size in sizes:
+        rate = best_rate(parse_batches(handler, size), messages, repeat)
+        print('{:>10} {:>12.0f} {:>7.2f}x'.format(size, rate, rate / each))
+
+
+if __name__ == '__main__':
+    main()
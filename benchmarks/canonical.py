@@ -0,0 +1,92 @@
+"""
+Title fetches saved by canonicalizing links.
+
+Parses a synthetic corpus in which `--variants` of the links are written
+some other way that leads to the same page: without a scheme, with a
+capitalized host, a default port, a fragment or tracking parameters.
+Titles aren't downloaded; each fetch is counted and answered straight
+away. Fetches are counted with links keyed as matched, as before they
+were canonicalized, and by their canonical form, and the cost of
+canonicalizing is timed per link.
+
+Usage:
+  canonical [options]
+
+Options:
+  --messages=<n>  Messages to parse [default: 20000].
+  --variants=<p>  Chance a link is written another way [default: 0.3].
+  --domains=<n>   Hosts links point at [default: 50].
+  --pages=<n>     Pages on each host [default: 20].
+  -h --help       Show this screen.
+"""
+from __future__ import print_function
+
+import timeit
+
+from docopt import docopt
+
+from chat_parser import caches, parsers
+from chat_parser.handlers import Handler
+
+from .corpus import generate
+
+
+class RawLinkParser(parsers.LinkParser):
+    """Fetches and caches links as they were matched."""
+    def canonical(self, url):
+        return url
+
+
+def count_fetches(messages, parser_class):
+    """Returns the titles fetched parsing `messages`, and the links."""
+    fetched = []
+
+    def fetch_title(url):
+        fetched.append(url)
+        return url
+
+    class CountingHandler(Handler):
+        parser_classes = dict(Handler.parser_classes, links=parser_class)
+
+    handler = CountingHandler()
+    handler.parsers['links'].title_cache = caches.MemoryCache(
+        max_size=len(messages))
+    fetch = parsers.fetch_title
+    parsers.fetch_title = fetch_title
+    try:
+        results = list(handler.parse_many(messages))
+    finally:
+        parsers.fetch_title = fetch
+    links = sum(len(data.get('links', ())) for data in results)
+    return len(fetched), links
+
+
+def main():
+    args = docopt(__doc__)
+    messages = list(generate(
+        int(args['--messages']), domains=int(args['--domains']),
+        pages=int(args['--pages']), link_variants=float(args['--variants'])))
+
+    print('{:>10} {:>8} {:>8}'.format('', 'links', 'fetches'))
+    counts = {}
+    for name, parser_class in [
+            ('matched', RawLinkParser), ('canonical', parsers.LinkParser)]:
+        fetches, links = count_fetches(messages, parser_class)
+        counts[name] = fetches
+        print('{:>10} {:>8} {:>8}'.format(name, links, fetches))
+    print('{:.1%} fewer fetches'.format(
+        1 - float(counts['canonical']) / counts['matched']))
+
+    urls = [
+        url for message in messages
+        for url in parsers.LinkParser().matches(message)
+    ]
+    took = min(timeit.repeat(
+        lambda: [parsers.canonical_url(url) for url in urls],
+        number=1, repeat=5))
+    print('{:.2f} us to canonicalize a link'.format(took / len(urls) * 1e6))
+    parsers.shutdown()
+
+
+if __name__ == '__main__':
+    main()
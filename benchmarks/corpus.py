@@ -0,0 +1,75 @@
+"""
+Generates synthetic chat messages.
+"""
+import random
+
+WORDS = (
+    "the deploy is done and everything looks fine from here so far but "
+    "let me know if anything breaks after lunch ok thanks"
+).split()
+
+EMOTICONS = [
+    'success', 'failed', 'thumbsup', 'coffee', 'megusta', 'shrug', 'party',
+]
+
+
+def generate(count, mentions=0.5, emoticons=0.3, links=0.3, long_lines=0.02,
+             users=100, domains=50, pages=1000, link_base=None,
+             link_variants=0, seed=0):
+    """
+    Yields `count` messages.
+
+    `mentions`, `emoticons` and `links` are the chance a message has one
+    of each, and `long_lines` the chance it's a long pasted blob (a stack
+    trace, a log excerpt) rather than a short sentence. Links point at
+    one of `pages` on one of `domains` hosts, or at paths under
+    `link_base` if given (for a local stub server). `link_variants` is
+    the chance a link is written some other way that leads to the same
+    page, as links pasted from browsers, emails and campaigns are.
+    """
+    rand = random.Random(seed)
+    for i in range(count):
+        if rand.random() < long_lines:
+            length = rand.randint(200, 2000)
+        else:
+            length = rand.randint(3, 25)
+        words = [rand.choice(WORDS) for _ in range(length)]
+
+        if rand.random() < mentions:
+            words.insert(rand.randint(0, len(words)),
+                         '@user{}'.format(rand.randint(0, users)))
+        if rand.random() < emoticons:
+            words.insert(rand.randint(0, len(words)),
+                         '({})'.format(rand.choice(EMOTICONS)))
+        if rand.random() < links:
+            domain = rand.randint(0, domains)
+            if link_base:
+                link = '{}/example{}'.format(link_base, domain)
+            else:
+                link = 'https://example{}.com/page/{}'.format(
+                    domain, rand.randint(0, pages))
+            if link_variants and rand.random() < link_variants:
+                link = variant(link, rand)
+            words.insert(rand.randint(0, len(words)), link)
+
+        yield ' '.join(words)
+
+
+def variant(link, rand):
+    """Returns `link` written another way that leads to the same page."""
+    scheme, rest = link.split('://', 1)
+    host, path = rest.split('/', 1)
+    choice = rand.randint(0, 5)
+    if choice == 0:
+        return '{}/{}'.format(host, path)
+    elif choice == 1:
+        return '{}://{}/{}'.format(scheme.upper(), host.capitalize(), path)
+    elif choice == 2:
+        port = 443 if scheme == 'https' else 80
+        return '{}://{}:{}/{}'.format(scheme, host, port, path)
+    elif choice == 3:
+        return '{}#section-{}'.format(link, rand.randint(1, 5))
+    elif choice == 4:
+        return '{}?utm_source={}&utm_medium=chat'.format(
+            link, rand.choice(['slack', 'email', 'twitter']))
+    return '{}?fbclid={:x}'.format(link, rand.getrandbits(64))
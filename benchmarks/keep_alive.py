@@ -0,0 +1,54 @@
+"""
+Compares title fetches on a new connection each time with fetches over
+the shared keep-alive session.
+
+Reports how many connections the stub server accepted and the mean
+latency per link.
+
+Usage:
+    python -m benchmarks.keep_alive
+"""
+from __future__ import print_function
+
+import time
+
+import mock
+import requests
+
+from chat_parser import parsers
+
+from .stub import start_server
+
+LINKS = 200
+
+
+def run(server, new_session):
+    parsers.shutdown()
+    urls = [
+        '{}/delay/0/link{}'.format(server.base_url, i) for i in range(LINKS)
+    ]
+    server.connections = 0
+    start = time.time()
+    if new_session:
+        # What every fetch did before sessions were shared.
+        with mock.patch.object(parsers, 'session', requests.Session):
+            for url in urls:
+                parsers.fetch_title(url)
+    else:
+        for url in urls:
+            parsers.fetch_title(url)
+    took = time.time() - start
+    return server.connections, took / LINKS * 1000
+
+
+def main():
+    server = start_server()
+    print('{:>12} {:>12} {:>12}'.format('', 'connections', 'ms/link'))
+    for name, new_session in [('new', True), ('keep-alive', False)]:
+        connections, latency = run(server, new_session)
+        print('{:>12} {:>12} {:>12.2f}'.format(name, connections, latency))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
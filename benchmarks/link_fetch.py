@@ -0,0 +1,51 @@
+"""
+Measures how long LinkParser takes to fetch titles for one message.
+
+Every link points at a local stub that answers after a fixed delay. With
+concurrent fetching the message latency should track the slowest link,
+not the sum of every link. Links are spread over one stub per worker, so
+the per-host limit doesn't hold them back.
+
+Usage:
+    python -m benchmarks.link_fetch
+"""
+from __future__ import print_function
+
+import time
+
+from chat_parser.parsers import LinkParser
+
+from .stub import start_server
+
+
+def run(servers, delays):
+    urls = [
+        '{}/delay/{}/link{}'.format(
+            servers[i % len(servers)].base_url, delay, i)
+        for i, delay in enumerate(delays)
+    ]
+    start = time.time()
+    LinkParser().clean_matches(urls)
+    return time.time() - start
+
+
+def main():
+    LinkParser.title_cache = None
+    servers = [start_server() for i in range(LinkParser.max_workers)]
+    cases = [
+        [0.5],
+        [0.1, 0.2, 0.3, 0.5],
+        [0.5] * LinkParser.max_workers,
+        [0.5] * (LinkParser.max_workers * 2),
+    ]
+    print('{:>6} {:>8} {:>8} {:>8}'.format('links', 'sum', 'slowest', 'took'))
+    for delays in cases:
+        took = run(servers, delays)
+        print('{:>6} {:>8.2f} {:>8.2f} {:>8.2f}'.format(
+            len(delays), sum(delays), max(delays), took))
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Memory held per parsed message, as dicts and as compact `Result`s.
+
+Parses a synthetic corpus without fetching titles and measures what the
+results keep alive: `sys.getsizeof` over every object reachable from
+them, counting shared objects (interned strings) once, and on Python 3
+the allocations `tracemalloc` sees while building them.
+
+Usage:
+  memory [options]
+
+Options:
+  --messages=<n>  Messages to parse [default: 100000].
+  -h --help       Show this screen.
+"""
+from __future__ import print_function
+
+import gc
+import sys
+
+from docopt import docopt
+
+from chat_parser.handlers import Handler
+
+from .corpus import generate
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+def deep_size(objects):
+    """Bytes of every distinct object reachable from `objects`."""
+    seen = set()
+    stack = list(objects)
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(
+                getattr(obj, slot) for slot in obj.__slots__
+                if hasattr(obj, slot))
+    return size
+
+
+def parse_all(messages, compact):
+    handler = Handler(titles=False, compact=compact)
+    return [handler.parse(message) for message in messages]
+
+
+def traced_size(messages, compact):
+    gc.collect()
+    tracemalloc.start()
+    results = parse_all(messages, compact)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return size
+
+
+def main():
+    args = docopt(__doc__)
+    messages = list(generate(int(args['--messages'])))
+
+    print('{:>10} {:>16} {:>16}'.format(
+        '', 'getsizeof B/msg', 'traced B/msg'))
+    for name, compact in [('dict', False), ('compact', True)]:
+        results = parse_all(messages, compact)
+        size = deep_size(results) - sys.getsizeof(results)
+        del results
+        traced = traced_size(messages, compact) if tracemalloc else None
+        print('{:>10} {:>16.1f} {:>16}'.format(
+            name, float(size) / len(messages),
+            '-' if traced is None else
+            '{:.1f}'.format(float(traced) / len(messages))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Pathological link inputs.
+
+Compares `LinkParser.regex` with the linear time tokenizer that replaced
+it, on ordinary messages and on inputs that make the regex backtrack.
+Run it with `python -m benchmarks.pathological`.
+
+Usage:
+  pathological [options]
+
+Options:
+  --max-size=<n>  Largest pathological input, in characters. The regex
+                  takes about two seconds at 8000 [default: 8000].
+  -h --help       Show this screen.
+"""
+from __future__ import print_function
+
+import time
+import timeit
+
+from docopt import docopt
+
+from chat_parser.parsers import LinkParser
+from chat_parser.tokenizers import find_urls
+
+from .corpus import generate
+
+PATHOLOGICAL = [
+    ('letters', lambda n: 'a' * n),
+    ('digits', lambda n: '1' * n),
+    ('base64', lambda n: ('QUJDREVGR0hJSktMTU5PUFFSU1RVVldYWVo' * n)[:n]),
+    ('dot then letters', lambda n: 'a.' + 'a' * (n - 3) + '1'),
+    ('letters then @', lambda n: 'a' * (n - 1) + '@'),
+    ('scheme', lambda n: 'http://' + 'a' * (n - 7)),
+    ('trailing hyphen', lambda n: 'a' * (n - 1) + '-'),
+]
+
+
+def regex_urls(string):
+    return [m.group(1) for m in LinkParser.regex.finditer(string)]
+
+
+def best_of(func, string, repeat=3):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func(string)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    args = docopt(__doc__)
+    max_size = int(args['--max-size'])
+
+    messages = list(generate(5000, links=0.5))
+    for name, func in [('regex', regex_urls), ('tokenizer', find_urls)]:
+        took = min(timeit.repeat(
+            lambda: [func(m) for m in messages], number=1, repeat=3))
+        print('{:>10} {:>12.0f} messages/s'.format(
+            name, len(messages) / took))
+    print()
+
+    sizes = []
+    size = 1000
+    while size <= max_size:
+        sizes.append(size)
+        size *= 2
+
+    print('{:<18} {:>8} {:>12} {:>12}'.format(
+        'input', 'chars', 'regex ms', 'tokenizer ms'))
+    for name, make in PATHOLOGICAL:
+        for size in sizes:
+            string = make(size)
+            assert regex_urls(string) == find_urls(string)
+            print('{:<18} {:>8} {:>12.2f} {:>12.2f}'.format(
+                name, size, best_of(regex_urls, string) * 1000,
+                best_of(find_urls, string) * 1000))
+
+
+if __name__ == '__main__':
+    main()
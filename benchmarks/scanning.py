@@ -0,0 +1,51 @@
+"""
+Compares fused single-pass scanning with one scan per parser.
+
+Both scan for the same parsers: those `Scanner` can fuse, which leaves
+out links. Only the raw matches are timed; link titles are not fetched.
+
+Usage:
+    python -m benchmarks.scanning
+"""
+from __future__ import print_function
+
+import timeit
+
+from chat_parser.handlers import Handler
+from chat_parser.scanners import Scanner
+
+MESSAGES = [
+    "@bob @john (success) such a cool feature; "
+    "https://twitter.com/jdorfman/status/430511497475670016",
+    "Good morning! (megusta) (coffee)",
+    "Hey, @Finn, check out what @BMO can do: "
+    "https://www.youtube.com/watch?v=ZRlUmkHlCCg (breadcrumbs).",
+    "Olympics are starting soon; http://www.nbcolympics.com",
+    "just a plain message with nothing special in it at all, " * 4,
+]
+
+
+def main():
+    parsers = Handler().parsers
+    scanner = Scanner(parsers)
+
+    fused_parsers = [parsers[key] for key in scanner.keys]
+
+    def separate():
+        for message in MESSAGES:
+            for parser in fused_parsers:
+                parser.matches(message)
+
+    def fused():
+        for message in MESSAGES:
+            scanner.scan(message)
+
+    number = 2000
+    for name, func in [('separate', separate), ('fused', fused)]:
+        took = min(timeit.repeat(func, number=number, repeat=3))
+        rate = number * len(MESSAGES) / took
+        print('{:>10} {:>12.0f} messages/s'.format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
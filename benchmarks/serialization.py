@@ -0,0 +1,65 @@
+"""
+Compares the output formats: bytes written and time per message.
+
+Messages come from the synthetic corpus, with titles filled in as if
+they'd been fetched.
+
+Usage:
+    python -m benchmarks.serialization
+"""
+from __future__ import print_function
+
+import io
+import timeit
+
+from chat_parser.handlers import Handler
+from chat_parser.serializers import serializer_classes
+
+from .corpus import generate
+
+
+def messages(count=2000):
+    handler = Handler()
+    for string in generate(count, links=0.5):
+        data = handler.scan(string)
+        if 'links' in data:
+            data['links'] = [
+                {'url': url, 'title': 'The page at {}'.format(url)}
+                for url in data['links']
+            ]
+        yield data
+
+
+def main():
+    corpus = list(messages())
+    print('{:>8} {:>12} {:>14} {:>14}'.format(
+        'format', 'bytes/msg', 'serialize us', 'dump us'))
+    for format, cls in sorted(serializer_classes.items()):
+        serializer = cls()
+        size = sum(len(serializer.serialize(data)) for data in corpus)
+        # Under Python 3 only binary records are bytes; the rest are text.
+        if isinstance(serializer.terminator, bytes):
+            stream = io.BytesIO
+        else:
+            stream = io.StringIO
+
+        def serialize():
+            for data in corpus:
+                serializer.serialize(data)
+
+        def dump():
+            f = stream()
+            for data in corpus:
+                serializer.dump(data, f)
+
+        number = 5
+        per_message = number * len(corpus) / 1e6
+        serialize_took = min(timeit.repeat(serialize, number=number, repeat=3))
+        dump_took = min(timeit.repeat(dump, number=number, repeat=3))
+        print('{:>8} {:>12.1f} {:>14.2f} {:>14.2f}'.format(
+            format, size / float(len(corpus)),
+            serialize_took / per_message, dump_took / per_message))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Load tests `chatparse serve`.
+
+Starts the server in its own process on a free port, with link titles
+served by a local stub that answers after `--delay` seconds. Then
+`--clients` threads post messages from the synthetic corpus for
+`--duration` seconds, one at a time or `--batch` at a time, each over a
+kept-alive connection. Reports throughput, latency and how many requests
+were turned away with 503.
+
+For comparison, it also times `--spawn` messages parsed by running
+`chatparse` once per message, as callers did before the server.
+
+Usage:
+  serve_load [options]
+
+Options:
+  --clients=<n>   Concurrent clients [default: 16].
+  --duration=<s>  Seconds to run for [default: 10].
+  --batch=<n>     Messages per request; 1 uses /parse, more /batch
+                  [default: 1].
+  --threads=<n>   Server threads [default: 8].
+  --queue=<n>     Server queue size [default: 64].
+  --delay=<s>     Seconds the stub takes to answer a title fetch
+                  [default: 0.05].
+  --spawn=<n>     Messages to parse with a chatparse run each; 0 to skip
+                  [default: 20].
+  -h --help       Show this screen.
+"""
+from __future__ import print_function
+
+import itertools
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from docopt import docopt
+
+from .corpus import generate
+from .stub import start_server
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_chatparse(port, threads, queue):
+    process = subprocess.Popen([
+        sys.executable, '-m', 'chat_parser.main', 'serve',
+        '--port', str(port), '--threads', str(threads), '--queue', str(queue),
+    ])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process
+        except socket.error:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("chatparse serve didn't start.")
+
+
+def run_clients(url, messages, clients, duration, batch):
+    """Returns each request's latency, and the number turned away."""
+    latencies = []
+    rejected = [0]
+    lock = threading.Lock()
+    stop = time.time() + duration
+    lines = itertools.cycle(messages)
+
+    def client():
+        session = requests.Session()
+        while time.time() < stop:
+            with lock:
+                body = '\n'.join(next(lines) for i in range(batch))
+            start = time.time()
+            response = session.post(url, data=body.encode('utf-8'))
+            took = time.time() - start
+            with lock:
+                if response.status_code == 503:
+                    rejected[0] += 1
+                else:
+                    response.raise_for_status()
+                    latencies.append(took)
+
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, rejected[0]
+
+
+def spawn_rate(messages):
+    """Messages per second parsed by a `chatparse` run each."""
+    start = time.time()
+    for message in messages:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'chat_parser.main', '--format', 'compact'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        process.communicate(message.encode('utf-8'))
+    return len(messages) / (time.time() - start)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    args = docopt(__doc__)
+    clients = int(args['--clients'])
+    duration = float(args['--duration'])
+    batch = int(args['--batch'])
+    spawn = int(args['--spawn'])
+
+    stub = start_server()
+    link_base = '{}/delay/{}'.format(stub.base_url, args['--delay'])
+    messages = list(generate(10000, link_base=link_base))
+
+    port = free_port()
+    server = start_chatparse(port, args['--threads'], args['--queue'])
+    endpoint = '/parse' if batch == 1 else '/batch'
+    try:
+        latencies, rejected = run_clients(
+            'http://127.0.0.1:{}{}'.format(port, endpoint), messages,
+            clients, duration, batch)
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait()
+
+    print('{:>12} {:>10} {:>10} {:>8} {:>8} {:>8}'.format(
+        '', 'requests/s', 'messages/s', 'p50 ms', 'p99 ms', '503s'))
+    print('{:>12} {:>10.0f} {:>10.0f} {:>8.1f} {:>8.1f} {:>8}'.format(
+        'serve', len(latencies) / duration,
+        len(latencies) * batch / duration,
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000, rejected))
+
+    if spawn:
+        rate = spawn_rate(messages[:spawn])
+        print('{:>12} {:>10.1f} {:>10.1f}'.format('spawn', rate, rate))
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Startup time.
+
+Times fresh interpreters importing chat_parser and running `chatparse` on
+one message, with and without link titles. Titles aren't fetched here:
+`--timeout 0` gives up on them straight away, so the difference is the
+cost of loading the HTTP and HTML libraries. Where the interpreter
+supports `-X importtime` (Python 3.7+), also lists the slowest imports,
+so it runs on Python 3 as well. Run it with `python -m benchmarks.startup`.
+
+Usage:
+  startup [options]
+
+Options:
+  --repeat=<n>  Runs of each command; the fastest is reported [default: 10].
+  --top=<n>     Slowest imports to list [default: 10].
+  -h --help     Show this screen.
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+MESSAGE = b'@finn (bmo) http://127.0.0.1:9/\n'
+
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import', ['-c', 'import chat_parser']),
+    ('import all', [
+        '-c', 'import chat_parser, requests, lxml.etree, sqlite3']),
+    ('cli', ['-m', 'chat_parser.main', '--timeout', '0']),
+    ('cli no titles', ['-m', 'chat_parser.main', '--no-titles']),
+]
+
+
+def best_of(args, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable] + args, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process.communicate(MESSAGE)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def slowest_imports(top):
+    """
+    Returns (cumulative microseconds, module) for the `top` slowest
+    imports of chat_parser.
+    """
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import chat_parser'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err = process.communicate()[1].decode('utf-8')
+    imports = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    args = docopt(__doc__)
+    repeat = int(args['--repeat'])
+
+    print('{:>14} {:>10}'.format('', 'ms'))
+    for name, command in COMMANDS:
+        took = best_of(command, repeat)
+        print('{:>14} {:>10.1f}'.format(name, took * 1000))
+
+    if sys.version_info >= (3, 7):
+        print('')
+        print('{:>10}  {}'.format('us', 'import'))
+        for cumulative, module in slowest_imports(int(args['--top'])):
+            print('{:>10}  {}'.format(cumulative, module))
+
+
+if __name__ == '__main__':
+    main()
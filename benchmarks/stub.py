@@ -0,0 +1,98 @@
+"""
+A local HTTP server for benchmarking the fetch path.
+
+Paths are a series of options followed by the page's title:
+    /delay/<seconds>/...  sleeps before answering
+    /offset/<bytes>/...   pads the <head> so <title> starts past <bytes>
+    /size/<bytes>/...     pads the body after </title> to <bytes> in total
+    /<title>              answers with <title>title</title>
+
+For example /delay/0.5/size/1048576/slow is a 1 MB page, titled "slow",
+sent after half a second.
+"""
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests.
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write; small unbuffered writes stall on
+    # delayed ACKs once the connection is reused.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    options = ('delay', 'offset', 'size')
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(
+                self.server.max_active, self.server.active)
+        try:
+            self.respond()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def respond(self):
+        parts = self.path.strip('/').split('/')
+        options = {}
+        while len(parts) > 2 and parts[0] in self.options:
+            options[parts[0]] = float(parts[1])
+            parts = parts[2:]
+        time.sleep(options.get('delay', 0))
+
+        head = '<html><head>' + ' ' * int(options.get('offset', 0))
+        body = head + '<title>{}</title></head><body>'.format('/'.join(parts))
+        body += ' ' * max(0, int(options.get('size', 0)) - len(body) - 14)
+        body += '</body></html>'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+        # Number of TCP connections accepted.
+        self.connections = 0
+        # Requests being answered now, and the most there have been at once.
+        self.active = 0
+        self.max_active = 0
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on big pages once they've read the title.
+        pass
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+def start_server():
+    """Starts a stub server on a free port in a background thread."""
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
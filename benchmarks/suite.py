@@ -0,0 +1,158 @@
+"""Chat Parse benchmarks.
+
+Measures parser and handler throughput on a synthetic corpus and title
+fetch latency against a local stub server, and compares the results
+with an earlier run. Run it with `python -m benchmarks.suite`.
+
+Usage:
+  suite [options]
+
+Options:
+  --messages=<n>      Messages in the corpus [default: 20000].
+  --mentions=<p>      Chance a message has a mention [default: 0.5].
+  --emoticons=<p>     Chance a message has an emoticon [default: 0.3].
+  --links=<p>         Chance a message has a link [default: 0.3].
+  --long-lines=<p>    Chance a message is a long blob [default: 0.02].
+  --fetches=<n>       Fetches per latency measurement [default: 50].
+  --delays=<s>        Comma separated stub delays [default: 0,0.05].
+  --sizes=<bytes>     Comma separated stub body sizes [default: 1024,1048576].
+  --output=<path>     Save results as JSON.
+  --baseline=<path>   Compare with results saved by an earlier run.
+  --threshold=<p>     Fail if anything is this much worse than the
+                      baseline [default: 0.1].
+  -h --help           Show this screen.
+"""
+from __future__ import print_function
+
+import json
+import platform
+import sys
+import time
+
+from docopt import docopt
+
+from chat_parser import caches, parsers
+from chat_parser.handlers import Handler
+
+from .corpus import generate
+from .stub import start_server
+
+
+def rate(func, messages):
+    """Returns messages per second for `func` over `messages`."""
+    start = time.time()
+    for message in messages:
+        func(message)
+    return {'messages_per_s': len(messages) / (time.time() - start)}
+
+
+def latency(func, args):
+    """Returns latency percentiles, in ms, of `func` over `args`."""
+    times = []
+    for arg in args:
+        start = time.time()
+        func(arg)
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return {
+        'mean_ms': sum(times) / len(times),
+        'p50_ms': times[len(times) // 2],
+        'p95_ms': times[int(len(times) * 0.95)],
+    }
+
+
+def run(args, server):
+    messages = list(generate(
+        int(args['--messages']),
+        mentions=float(args['--mentions']),
+        emoticons=float(args['--emoticons']),
+        links=float(args['--links']),
+        long_lines=float(args['--long-lines']),
+        link_base=server.base_url))
+    results = {}
+
+    handler = Handler()
+    for key, parser in sorted(handler.parsers.items()):
+        if handler.is_deferred(parser):
+            func = parser.matches
+        else:
+            func = parser.parse
+        results['parser.{}'.format(key)] = rate(func, messages)
+
+    results['handler.scan'] = rate(handler.scan, messages)
+    # Titles come from the stub; most links repeat, as in real traffic.
+    parsers.LinkParser.title_cache = caches.MemoryCache()
+    results['handler.parse'] = rate(handler.parse, messages)
+
+    fetches = int(args['--fetches'])
+    for delay in args['--delays'].split(','):
+        for size in args['--sizes'].split(','):
+            urls = [
+                '{}/delay/{}/size/{}/page{}'.format(
+                    server.base_url, delay, size, i)
+                for i in range(fetches)
+            ]
+            name = 'fetch_title.delay={}.size={}'.format(delay, size)
+            results[name] = latency(parsers.fetch_title, urls)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints each metric's change from `baseline`. Returns False if any got
+    worse by more than `threshold`.
+    """
+    ok = True
+    print('{:<48} {:>12} {:>12} {:>8}'.format(
+        'metric', 'baseline', 'now', 'change'))
+    for name in sorted(results):
+        for metric, value in sorted(results[name].items()):
+            old = baseline.get(name, {}).get(metric)
+            if not old:
+                continue
+            change = (value - old) / old
+            # Rates should go up, latencies down.
+            worse = -change if metric.endswith('_per_s') else change
+            flag = ''
+            if worse > threshold:
+                flag = ' !'
+                ok = False
+            print('{:<48} {:>12.2f} {:>12.2f} {:>+7.0%}{}'.format(
+                '{}.{}'.format(name, metric), old, value, change, flag))
+    return ok
+
+
+def main():
+    args = docopt(__doc__)
+    server = start_server()
+    try:
+        results = run(args, server)
+    finally:
+        server.shutdown()
+        parsers.shutdown()
+
+    for name in sorted(results):
+        for metric, value in sorted(results[name].items()):
+            print('{:<48} {:>12.2f}'.format(
+                '{}.{}'.format(name, metric), value))
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'time': time.time(),
+                'args': args,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args['--baseline']:
+        with open(args['--baseline']) as f:
+            baseline = json.load(f)['results']
+        print()
+        if not compare(results, baseline, float(args['--threshold'])):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Measures how scanning scales across worker processes.
+
+Scans a synthetic corpus with `Handler.scan_parallel`; titles aren't
+fetched, so this is the CPU-bound regex stage only.
+
+Usage:
+    python -m benchmarks.workers [messages]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from chat_parser.handlers import Handler
+
+from .corpus import generate
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    handler = Handler()
+
+    start = time.time()
+    for string in generate(count):
+        handler.scan(string)
+    baseline = time.time() - start
+    print('{:>8} {:>12} {:>8}'.format('workers', 'messages/s', 'speedup'))
+    print('{:>8} {:>12.0f} {:>8.2f}'.format('-', count / baseline, 1))
+
+    for workers in [1, 2, 4, 8]:
+        start = time.time()
+        for data in handler.scan_parallel(generate(count), workers=workers):
+            pass
+        took = time.time() - start
+        print('{:>8} {:>12.0f} {:>8.2f}'.format(
+            workers, count / took, baseline / took))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from .handlers import parse  # NOQA
+from .handlers import parse, parse_many, parse_parallel  # NOQA
 
 
 __version__ = '0.0.1'
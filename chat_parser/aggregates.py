@@ -0,0 +1,230 @@
+"""
+Approximate top mentions, emoticons and link domains over many messages.
+
+Messages are scanned without fetching titles, and their tokens counted
+in Space-Saving sketches (Metwally et al., "Efficient Computation of
+Frequent and Top-k Elements in Data Streams") of a fixed `capacity`, so
+memory doesn't grow with the log. Every item in a sketch has a `count`
+and an `error`: its true count is between `count - error` and `count`.
+Any item the sketch doesn't hold has been seen at most `minimum()`
+times, which is never more than `total / capacity`.
+
+Sketches of separate shards of a log can be merged (Agarwal et al.,
+"Mergeable Summaries") with the same guarantees, so shards can be
+counted in parallel, or in separate runs and combined later.
+"""
+import heapq
+import itertools
+
+from .handlers import Handler, map_chunks
+from .schedulers import url_host
+
+
+class SpaceSaving(object):
+    """Counts the most frequent of a stream of items in `capacity` slots."""
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.total = 0
+        # The most times an item may have been seen in merged streams
+        # without being held.
+        self.floor = 0
+        # Item to [count, error].
+        self.counters = {}
+        # (count, item) for every item. Counts only grow, so an entry's
+        # count may be behind its counter; it's brought up to date when
+        # it reaches the top.
+        self.heap = []
+
+    def add(self, item, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+            heapq.heappush(self.heap, (count, item))
+        else:
+            # The new item takes over the smallest counter, and may have
+            # been counted there all along.
+            low, evicted = self.lowest()
+            del self.counters[evicted]
+            self.counters[item] = [low + count, low]
+            heapq.heapreplace(self.heap, (low + count, item))
+
+    def lowest(self):
+        """Returns the smallest (count, item), with the heap's top current."""
+        while True:
+            count, item = self.heap[0]
+            current = self.counters[item][0]
+            if count == current:
+                return count, item
+            heapq.heapreplace(self.heap, (current, item))
+
+    def minimum(self):
+        """The most times an item the sketch doesn't hold can have been seen."""
+        if len(self.counters) < self.capacity:
+            return self.floor
+        return max(self.floor, self.lowest()[0])
+
+    def top(self, k=None):
+        """Returns the `k` largest (item, count, error), largest first."""
+        counters = sorted(
+            self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [
+            (item, count, error)
+            for item, (count, error) in itertools.islice(counters, k)
+        ]
+
+    def merge(self, other):
+        """
+        Returns a sketch of both streams, with the smaller capacity of the
+        two: its error bounds are no tighter.
+        """
+        merged = SpaceSaving(min(self.capacity, other.capacity))
+        merged.total = self.total + other.total
+        # An item missing from one sketch may have been seen up to its
+        # minimum times in that stream.
+        low, other_low = self.minimum(), other.minimum()
+        merged.floor = low + other_low
+        counters = []
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, (low, low))
+            other_count, other_error = other.counters.get(
+                item, (other_low, other_low))
+            counters.append(
+                (count + other_count, -error - other_error, item))
+        for count, error, item in heapq.nlargest(merged.capacity, counters):
+            merged.counters[item] = [count, -error]
+            merged.heap.append((count, item))
+        heapq.heapify(merged.heap)
+        return merged
+
+    def to_dict(self):
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "floor": self.floor,
+            "counters": [list(counter) for counter in self.top()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.total = data['total']
+        sketch.floor = data['floor']
+        for item, count, error in data['counters']:
+            sketch.counters[item] = [count, error]
+            sketch.heap.append((count, item))
+        heapq.heapify(sketch.heap)
+        return sketch
+
+
+class Aggregator(object):
+    """
+    Counts the mentions, emoticons and link domains of messages, in a
+    sketch of `capacity` items each.
+
+    Mentions and emoticons are counted once per message they're in, as
+    `parse` lists them, and domains once per link.
+    """
+    keys = ('mentions', 'emoticons', 'domains')
+
+    def __init__(self, capacity=1000):
+        # Only used to scan, so titles are never fetched.
+        self.handler = Handler(titles=False)
+        self.messages = 0
+        self.sketches = dict((key, SpaceSaving(capacity)) for key in self.keys)
+
+    # Messages scanned at once by `add_all`.
+    batch_size = 1000
+
+    def add(self, string):
+        self.count(self.handler.scan(string))
+
+    def add_all(self, strings):
+        strings = iter(strings)
+        while True:
+            batch = list(itertools.islice(strings, self.batch_size))
+            if not batch:
+                return self
+            for data in self.handler.scan_batch(batch):
+                self.count(data)
+
+    def count(self, data):
+        """Counts the tokens of one message's `scan` result."""
+        self.messages += 1
+        for mention in data.get('mentions', ()):
+            self.sketches['mentions'].add(mention)
+        for emoticon in data.get('emoticons', ()):
+            self.sketches['emoticons'].add(emoticon)
+        for url in data.get('links', ()):
+            self.sketches['domains'].add(link_domain(url))
+
+    def merge(self, other):
+        """Adds the counts of another aggregator, in place."""
+        self.messages += other.messages
+        for key in self.keys:
+            self.sketches[key] = self.sketches[key].merge(other.sketches[key])
+        return self
+
+    def report(self, top=10):
+        """
+        Returns the `top` items of each sketch, with their counts and
+        error bounds.
+        """
+        report = {"messages": self.messages}
+        for key in self.keys:
+            sketch = self.sketches[key]
+            report[key] = {
+                "total": sketch.total,
+                # The most an item outside `top` can have been seen.
+                "missing_max": sketch.minimum(),
+                "top": [
+                    {"item": item, "count": count, "error": error}
+                    for item, count, error in sketch.top(top)
+                ],
+            }
+        return report
+
+    def to_dict(self):
+        data = dict(
+            (key, self.sketches[key].to_dict()) for key in self.keys)
+        data['messages'] = self.messages
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls()
+        aggregator.messages = data['messages']
+        for key in cls.keys:
+            aggregator.sketches[key] = SpaceSaving.from_dict(data[key])
+        return aggregator
+
+
+def link_domain(url):
+    """
+    Returns the host `url` points at, without its port.
+
+    Never raises, whatever the tokenizer matched, so one odd link can't
+    stop a count over a whole log.
+    """
+    return url_host(url).split(':')[0]
+
+
+def aggregate(strings, capacity=1000, workers=None, chunk_size=5000):
+    """
+    Returns an `Aggregator` of `strings`, counted across `workers`
+    processes if given.
+    """
+    if not workers:
+        return Aggregator(capacity).add_all(strings)
+
+    aggregator = Aggregator(capacity)
+    for data in map_chunks(
+            aggregate_chunk, strings, workers, chunk_size, capacity):
+        aggregator.merge(Aggregator.from_dict(data))
+    return aggregator
+
+def aggregate_chunk(capacity, strings):
+    """Counts a chunk of messages in an `aggregate` worker."""
+    return Aggregator(capacity).add_all(strings).to_dict()
@@ -0,0 +1,131 @@
+"""
+asyncio entry points.
+
+Requires Python 3.7+ and aiohttp (`pip install chat-parser[async]`).
+Mentions, emoticons and urls are found inline; link titles are fetched
+with non-blocking I/O on the running event loop.
+"""
+import asyncio
+import logging
+
+import aiohttp
+
+from . import parsers
+from .handlers import Handler
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHandler(Handler):
+    """
+    A Handler whose `parse` is a coroutine.
+
+    At most `concurrency` titles are fetched at once and each fetch is
+    given up on after `timeout` seconds. Cancelling `parse` cancels its
+    outstanding fetches.
+
+    Use as an async context manager, or call `close` when done, to
+    release pooled connections.
+    """
+    def __init__(self, concurrency=parsers.LinkParser.max_workers, timeout=4,
+                 session=None):
+        super(AsyncHandler, self).__init__()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session = session
+        self.owns_session = session is None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def parse(self, string):
+        return await self.resolve(self.scan(string))
+
+    async def resolve(self, data):
+        for key, parser in self.parsers.items():
+            if key in data and self.is_deferred(parser):
+                data[key] = await self.fetch_titles(parser, data[key])
+        return data
+
+    async def fetch_titles(self, parser, urls):
+        """The async equivalent of `LinkParser.clean_matches`."""
+        cache = parser.title_cache
+
+        async def title(url):
+            if cache is not None:
+                try:
+                    return cache.get(url)
+                except KeyError:
+                    pass
+            title = await self.fetch_title(url)
+            if cache is not None:
+                cache.set(url, title)
+            return title
+
+        # Equivalent links share a fetch, as in `LinkParser.fetch_titles`.
+        canonical = [parser.canonical(url) for url in urls]
+        unique = list(set(canonical))
+        titles = await asyncio.gather(*[title(url) for url in unique])
+        titles = dict(zip(unique, titles))
+        return [
+            {"url": url, "title": titles[key]}
+            for url, key in zip(urls, canonical)
+        ]
+
+    async def fetch_title(self, url):
+        """
+        The async equivalent of `parsers.fetch_title`.
+        """
+        logger.debug("Fetching title for: {}".format(url))
+
+        url = parsers.web_url(url)
+        if url is None:
+            return ''
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.semaphore:
+            try:
+                return await asyncio.wait_for(
+                    self.read_title(url), self.timeout)
+            except asyncio.TimeoutError:
+                logger.info("Fetching url: {} timed out.".format(url))
+            except aiohttp.ClientError:
+                logger.info("Fetching url: {} failed.".format(url))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.info("Error parsing page from: {}".format(url))
+            return ''
+
+    async def read_title(self, url):
+        async with self.session.get(url) as page:
+            reader = parsers.TitleReader(
+                page.headers.get('Content-Type'), parsers.MAX_TITLE_BYTES)
+            if reader.skipped:
+                logger.info("Skipping non HTML url: {}".format(url))
+                return ''
+
+            async for chunk in page.content.iter_chunked(parsers.CHUNK_SIZE):
+                reader.feed(chunk)
+                if reader.done:
+                    break
+            logger.debug("Read {} bytes from: {}".format(reader.read, url))
+            return reader.close()
+
+
+async def aparse(string, format='json'):
+    async with AsyncHandler() as handler:
+        return handler.serialize(await handler.parse(string), format)
@@ -0,0 +1,274 @@
+from __future__ import unicode_literals
+
+import copy
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from . import stats
+from .results import Result
+
+
+class TitleCache(object):
+    """
+    Caches link titles by url.
+
+    Titles expire after `ttl` seconds. Empty titles, which is what
+    `fetch_title` returns for dead links and pages it couldn't parse,
+    expire after the shorter `negative_ttl`. Once more than `max_size`
+    urls are cached the least recently used ones are evicted.
+
+    Subclasses implement `lookup`, `store` and `__len__`.
+    """
+    def __init__(self, max_size=10000, ttl=24 * 60 * 60, negative_ttl=5 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """Returns the cached title for `url`, or raises KeyError."""
+        with self.lock:
+            try:
+                title, expires = self.lookup(url, time.time())
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            return title
+
+    def expires(self, url):
+        """
+        Returns when the cached title for `url` expires, in `time.time()`
+        seconds, or raises KeyError. Doesn't count as a hit or miss.
+        """
+        with self.lock:
+            return self.lookup(url, time.time())[1]
+
+    def set(self, url, title):
+        ttl = self.ttl if title else self.negative_ttl
+        with self.lock:
+            self.evictions += self.store(url, title, time.time() + ttl)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self),
+            }
+
+    def lookup(self, url, now):
+        """
+        Returns the title for `url` and when it expires.
+
+        Raises KeyError if it isn't cached or has expired by `now`.
+        """
+        raise NotImplementedError()
+
+    def store(self, url, title, expires):
+        """Stores `title` and returns the number of urls evicted."""
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+
+class MemoryCache(TitleCache):
+    """An in process LRU title cache."""
+    def __init__(self, *args, **kwargs):
+        super(MemoryCache, self).__init__(*args, **kwargs)
+        self.titles = OrderedDict()
+
+    def lookup(self, url, now):
+        title, expires = self.titles.pop(url)
+        if expires <= now:
+            raise KeyError(url)
+        # Re-inserting moves the url to the most recently used end.
+        self.titles[url] = (title, expires)
+        return title, expires
+
+    def store(self, url, title, expires):
+        self.titles.pop(url, None)
+        self.titles[url] = (title, expires)
+
+        evicted = 0
+        while len(self.titles) > self.max_size:
+            self.titles.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def __len__(self):
+        return len(self.titles)
+
+
+class ParseCache(object):
+    """
+    An in process LRU cache of parse results, by message.
+
+    Messages are keyed by `key`, a SHA-256 digest of their text, so long
+    ones aren't kept around. Results are stored as `results.Result`s of
+    tuples, and every hit is given new dicts and lists, so what one
+    caller does to its result can't reach another. Once the stored
+    results take more than `max_bytes`, the least recently used are
+    evicted.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # Digest to (result, size, expires).
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(string):
+        if not isinstance(string, bytes):
+            string = string.encode('utf-8')
+        return hashlib.sha256(string).digest()
+
+    def get(self, key, compact=False):
+        """
+        Returns a copy of the cached result for the message `key`, as a
+        `Result` if `compact`, or raises KeyError.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[2] is not None and (
+                    entry[2] <= time.time()):
+                self.bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                stats.count('parse_cache.misses')
+                raise KeyError(key)
+            # Re-inserting moves the entry to the most recently used end.
+            self.entries[key] = entry
+            self.hits += 1
+        result = entry[0]
+        stats.count('parse_cache.hits')
+
+        if compact:
+            return copy_result(result)
+        return result.to_dict()
+
+    def set(self, key, data, ttl=None):
+        """
+        Caches `data`, a dict or `Result`, for the message `key`, for
+        `ttl` seconds or for good.
+        """
+        if isinstance(data, Result):
+            result = copy_result(data)
+        else:
+            # Interned strings would outlive evicted entries, and escape
+            # `max_bytes`.
+            result = Result.from_dict(data, intern=False)
+            result.extra = result.extra and copy.deepcopy(result.extra)
+        size = result_size(result)
+        expires = None if ttl is None else time.time() + ttl
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (result, size, expires)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self.entries:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'bytes': self.bytes,
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def copy_result(result):
+    """Returns a `Result` that shares only the immutable parts of `result`."""
+    return Result(result.mentions, result.emoticons, result.links,
+                  result.extra and copy.deepcopy(result.extra))
+
+
+def result_size(result):
+    """Roughly the bytes `result` and its cache entry take."""
+    size = sys.getsizeof(result) + 32 + 64  # Digest and entry tuple.
+    for values in (result.mentions, result.emoticons):
+        size += sys.getsizeof(values) + sum(map(sys.getsizeof, values))
+    size += sys.getsizeof(result.links)
+    for link in result.links:
+        size += (sys.getsizeof(link) + sys.getsizeof(link.url) +
+                 sys.getsizeof(link.title))
+    if result.extra:
+        size += sys.getsizeof(result.extra) + len(repr(result.extra))
+    return size
+
+
+class SQLiteCache(TitleCache):
+    """
+    A title cache stored in a sqlite database at `path`.
+
+    Separate processes pointed at the same file share their titles, so
+    titles fetched by one `chatparse` run are reused by the next.
+    """
+    def __init__(self, path, *args, **kwargs):
+        import sqlite3
+
+        super(SQLiteCache, self).__init__(*args, **kwargs)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # Urls read from stdin are utf-8 bytestrings.
+        self.db.text_factory = str
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS titles ('
+                'url TEXT PRIMARY KEY, title TEXT, expires REAL, used REAL)')
+            self.db.execute(
+                'CREATE INDEX IF NOT EXISTS titles_used ON titles (used)')
+
+    def lookup(self, url, now):
+        row = self.db.execute(
+            'SELECT title, expires FROM titles WHERE url = ? AND expires > ?',
+            (url, now)).fetchone()
+        if row is None:
+            raise KeyError(url)
+        with self.db:
+            self.db.execute(
+                'UPDATE titles SET used = ? WHERE url = ?', (now, url))
+        return row[0], row[1]
+
+    def store(self, url, title, expires):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?)',
+                (url, title, expires, time.time()))
+            evicted = len(self) - self.max_size
+            if evicted <= 0:
+                return 0
+            self.db.execute(
+                'DELETE FROM titles WHERE url IN ('
+                'SELECT url FROM titles ORDER BY used LIMIT ?)', (evicted,))
+        return evicted
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM titles').fetchone()[0]
@@ -1,8 +1,28 @@
+import codecs
+import copy
+import functools
+import importlib
+import mmap
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
+try:
+    from Queue import Queue
+except ImportError:  # Python 3
+    from queue import Queue
+
 from . import parsers
+from . import results
+from . import scanners
 from . import serializers
+from . import stats
 
 
 class Handler(object):
+    # Parser classes, or their dotted paths, which are imported when a
+    # handler is created.
     parser_classes = {
         'mentions': parsers.MentionParser,
         'emoticons': parsers.EmoticonParser,
@@ -11,21 +31,693 @@ class Handler(object):
 
     serializer_class = serializers.JSONSerializer
 
-    def parse(self, string):
+    def __init__(self, titles=True, compact=False, memo=None):
+        # Without titles, links are returned with their titles None and
+        # nothing is fetched.
+        self.titles = titles
+        # Return `results.Result`s rather than dicts, to hold many at once.
+        self.compact = compact
+        # A `caches.ParseCache` of `parse` results for repeated messages.
+        self.memo = memo
+        self.parsers = dict(
+            (key, load_class(cls)())
+            for key, cls in self.parser_classes.items())
+
+    @stats.timed('handler.parse')
+    def parse(self, string, timeout=None):
+        """
+        Parses `string`.
+
+        With a `timeout`, returns within that many seconds; link titles
+        that haven't been fetched by then are None.
+        """
+        if self.memo is not None:
+            key = self.memo.key(string)
+            try:
+                return self.memo.get(key, self.compact)
+            except KeyError:
+                pass
+
+        deadline = deadline_after(timeout)
+        data = self.resolve(self.scan(string), deadline)
+        if self.memo is not None:
+            self.memoize(key, data)
+        return data
+
+    def memoize(self, message_key, data):
+        """
+        Caches `data` under `message_key` until the first of its titles
+        expires from the title cache.
+
+        Results with titles that weren't fetched in time, or that aren't
+        in a title cache, aren't cached.
+        """
+        expires = None
+        if isinstance(data, results.Result):
+            data = data.to_dict()
+        for key, parser in self.parsers.items():
+            if not (self.titles and key in data and self.is_deferred(parser)):
+                continue
+            cache = parser.title_cache
+            if cache is None:
+                return
+            for link in data[key]:
+                if link['title'] is None:
+                    return
+                try:
+                    link_expires = cache.expires(parser.canonical(link['url']))
+                except KeyError:
+                    return
+                if expires is None or link_expires < expires:
+                    expires = link_expires
+
+        ttl = None
+        if expires is not None:
+            ttl = expires - time.time()
+            if ttl <= 0:
+                return
+        self.memo.set(message_key, data, ttl)
+
+    @stats.timed('handler.scan')
+    def scan(self, string):
+        """
+        Parses `string` without fetching anything.
+
+        Links are left as a list of matched urls; `resolve` fetches
+        their titles.
+        """
         data = {}
-        for key, cls in self.parser_classes.iteritems():
-            parser = cls()
-            matches = parser.parse(string)
+        for key, parser in self.parsers.items():
+            if self.is_deferred(parser):
+                matches = parser.matches(string)
+            else:
+                matches = parser.parse(string)
             if matches:
                 data[key] = matches
 
         return data
 
-    def serialize(self, data):
-        serializer = self.serializer_class()
-        return serializer.serialize(data)
+    @stats.timed('handler.scan_batch')
+    def scan_batch(self, strings):
+        """
+        Returns `scan` results for a batch of messages, in order.
+
+        The messages are joined into one buffer and each parser's
+        `batch_matches` scans it in one pass, rather than with a short
+        `finditer` per message, mapping matches back to their message by
+        offset. Parsers that can't scan a batch scan each message on its own.
+        """
+        strings = list(strings)
+        buffer, starts = scanners.join(strings)
+        found = {}
+        for key, parser in self.parsers.items():
+            matches = parser.batch_matches(buffer, starts)
+            if matches is not None:
+                found[key] = matches
+
+        results = []
+        for i, string in enumerate(strings):
+            data = {}
+            for key, parser in self.parsers.items():
+                deferred = self.is_deferred(parser)
+                if key in found:
+                    matches = found[key][i]
+                    if not deferred:
+                        matches = parser.clean_matches(matches)
+                elif deferred:
+                    matches = parser.matches(string)
+                else:
+                    matches = parser.parse(string)
+                if matches:
+                    data[key] = matches
+            results.append(data)
+        return results
+
+    @stats.timed('handler.resolve')
+    def resolve(self, data, deadline=None):
+        """
+        Fetches the titles for the links in `data` from `scan`, giving up
+        on them at `deadline`, in `time.time()` seconds.
+        """
+        for key, parser in self.parsers.items():
+            if key in data and self.is_deferred(parser):
+                if self.titles:
+                    data[key] = parser.clean_matches(data[key], deadline)
+                else:
+                    data[key] = untitled(data[key])
+        if self.compact:
+            return results.Result.from_dict(data)
+        return data
+
+    def parse_deferred(self, string):
+        """
+        Parses `string` without waiting for link titles.
+
+        Returns `(data, titles)`. `data` is the result of `parse` with
+        every link's title set to None; its titles are already being
+        fetched, and `titles` delivers them as they arrive.
+        """
+        data = self.scan(string)
+        pending = []
+        for key, parser in self.parsers.items():
+            if key in data and self.is_deferred(parser):
+                urls = data[key]
+                data[key] = untitled(urls)
+                if not self.titles:
+                    continue
+                futures = parser.fetch_titles(urls)
+                pending.extend(
+                    (key, index, url, future)
+                    for index, (url, future) in enumerate(zip(urls, futures)))
+        return data, Titles(data, pending)
+
+    def parse_deferred_stream(self, lines, window=32):
+        """
+        Parses an iterable of messages in two phases, yielding records.
+
+        Each message is yielded as soon as it's scanned, as its
+        `parse_deferred` data plus `"line"`, its 1-based position in
+        `lines`. Each link title follows in its own record once fetched:
+
+            {"line": 3, "key": "links", "index": 0,
+             "url": "...", "title": "..."}
+
+        As with `parse_many` each distinct url is fetched once. Titles are
+        outstanding for at most `window` messages at a time.
+        """
+        batch = self.batch()
+        records = Queue()
+        slots = threading.Semaphore(window)
+        done = object()
+        errors = []
+
+        def title_record(line, key, index, url, title):
+            records.put((line, {
+                "line": line, "key": key, "index": index,
+                "url": url, "title": title,
+            }, None))
+
+        def read():
+            try:
+                for line, string in enumerate(lines, 1):
+                    slots.acquire()
+                    data, titles = batch.parse_deferred(string)
+                    data["line"] = line
+                    # Queued before any of its titles can be.
+                    records.put((line, data, len(titles.pending)))
+                    titles.add_callback(
+                        functools.partial(title_record, line))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                records.put(done)
+
+        reader = threading.Thread(target=read)
+        reader.daemon = True
+        reader.start()
+
+        # Lines that still have titles to come, and how many.
+        remaining = {}
+        finished = False
+        while not finished or remaining:
+            item = records.get()
+            if item is done:
+                finished = True
+                continue
+            line, record, count = item
+            if count is None:  # A title.
+                remaining[line] -= 1
+                if not remaining[line]:
+                    del remaining[line]
+                    slots.release()
+            elif count:
+                remaining[line] = count
+            else:
+                slots.release()
+            yield record
+
+        if errors:
+            raise errors[0]
+
+    def incremental(self):
+        """
+        Returns an `IncrementalParser` for one message read in chunks.
+        """
+        return IncrementalParser(self)
+
+    def resolver(self, timeout=None):
+        """
+        Returns a function that resolves `scan` results, giving each
+        message `timeout` seconds from when its titles are requested.
+        """
+        def resolve(data):
+            return self.resolve(data, deadline_after(timeout))
+        return resolve
+
+    def is_deferred(self, parser):
+        """Whether `parser` cleans its matches in `resolve`."""
+        return isinstance(parser, parsers.LinkParser)
+
+    def parse_stream(self, lines, ordered=True, window=32, timeout=None):
+        """
+        Parses an iterable of messages, yielding one result per message.
+
+        Lines are read on a background thread and parsed concurrently, so
+        a message waiting on slow link titles doesn't hold up the messages
+        behind it. At most `window` messages are in flight at once, which
+        keeps memory flat however long `lines` is.
+
+        With `ordered` results are yielded in input order; otherwise they
+        are yielded as soon as each message is parsed. `timeout` is passed
+        to `parse` for each message.
+        """
+        parse = functools.partial(self.parse, timeout=timeout)
+        return self.pipeline(parse, lines, ordered, window)
+
+    def parse_many(self, strings, window=32, timeout=None):
+        """
+        Parses a batch of messages, yielding results in input order.
+
+        The batch shares one set of parsers, and each distinct url is
+        fetched once however many messages link to it. Like
+        `parse_stream`, only `window` messages are held at once.
+        """
+        return self.batch().parse_stream(
+            strings, window=window, timeout=timeout)
+
+    def parse_parallel(self, strings, workers=None, chunk_size=500,
+                       ordered=True, window=32, timeout=None):
+        """
+        Parses a batch of messages across `workers` processes.
+
+        Messages are scanned in chunks of `chunk_size` by a pool of
+        processes, each with its own instance of this handler's class.
+        Titles are fetched back in this process, once per distinct url as
+        with `parse_many`, so workers don't each hit the same hosts.
+        """
+        batch = self.batch()
+        scanned = self.scan_parallel(strings, workers, chunk_size)
+        return batch.pipeline(
+            batch.resolver(timeout), scanned, ordered, window)
+
+    def scan_parallel(self, strings, workers=None, chunk_size=500):
+        """
+        Yields `scan` results for `strings`, in order, from `workers`
+        processes.
+        """
+        import multiprocessing
+
+        workers = workers or multiprocessing.cpu_count()
+        for data in map_chunks(
+                scan_chunk, strings, workers, chunk_size, type(self)):
+            for result in data:
+                yield result
+
+    def parse_file(self, path, ordered=True, window=32, timeout=None):
+        """
+        Parses each line of the file at `path` as a message.
+
+        Lines are scanned by `scan_file`; titles are fetched as with
+        `parse_many`.
+        """
+        batch = self.batch()
+        scanned = self.scan_file(path)
+        return batch.pipeline(
+            batch.resolver(timeout), scanned, ordered, window)
+
+    def scan_file(self, path, block_size=8 * 1024 * 1024):
+        """
+        Yields `scan` results for each line of the file at `path`.
+
+        The file is memory-mapped and scanned as bytes, `block_size` bytes
+        of lines at a time, so memory stays near the page cache's working
+        set. Only matched tokens are decoded. Parsers without a bytes
+        version of their regex or `byte_matches` are given the decoded
+        line instead.
+        """
+        regexes = {}
+        for key, parser in self.parsers.items():
+            if scanners.Scanner.can_fuse(parser):
+                regex = scanners.byte_regex(parser.regex)
+                if regex is not None:
+                    regexes[key] = regex
+
+        with open(path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file.
+                return
+            try:
+                for result in self.scan_mapped(data, regexes, block_size):
+                    yield result
+            finally:
+                data.close()
+
+    def scan_mapped(self, data, regexes, block_size):
+        size = len(data)
+        start = 0
+        while start < size:
+            end = data.find(b'\n', min(start + block_size, size) - 1)
+            end = size if end == -1 else end + 1
+
+            line_starts = [start]
+            newline = data.find(b'\n', start, end)
+            while newline != -1 and newline + 1 < end:
+                line_starts.append(newline + 1)
+                newline = data.find(b'\n', newline + 1, end)
+
+            tokens = {}
+            for key, parser in self.parsers.items():
+                if key in regexes:
+                    tokens[key] = [
+                        (m.start(1), m.group(1))
+                        for m in regexes[key].finditer(data, start, end)
+                    ]
+                else:
+                    matches = parser.byte_matches(data, start, end)
+                    if matches is not None:
+                        tokens[key] = matches
+
+            found = {}
+            for key, matches in tokens.items():
+                lines = found[key] = [[] for line in line_starts]
+                for position, token in matches:
+                    lines[bisect_right(line_starts, position) - 1].append(
+                        token.decode('utf-8', 'replace'))
+
+            line_ends = line_starts[1:] + [end]
+            for i, (line_start, line_end) in enumerate(
+                    zip(line_starts, line_ends)):
+                string = None
+                result = {}
+                for key, parser in self.parsers.items():
+                    deferred = self.is_deferred(parser)
+                    if key in found:
+                        matches = found[key][i]
+                        if not deferred:
+                            matches = parser.clean_matches(matches)
+                    else:
+                        if string is None:
+                            string = data[line_start:line_end].decode(
+                                'utf-8', 'replace').rstrip('\n')
+                        if deferred:
+                            matches = parser.matches(string)
+                        else:
+                            matches = parser.parse(string)
+                    if matches:
+                        result[key] = matches
+                yield result
+
+            start = end
+
+    def batch(self):
+        """
+        Returns a copy of this handler for parsing one batch of messages.
+        """
+        batch = copy.copy(self)
+        batch.parsers = dict(
+            (key, parser.batch() if hasattr(parser, 'batch') else parser)
+            for key, parser in self.parsers.items())
+        return batch
+
+    def pipeline(self, func, items, ordered=True, window=32):
+        """
+        Yields `func(item)` for each of `items`, running up to `window`
+        calls at once on a thread pool.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        results = Queue()
+        slots = threading.Semaphore(window)
+        done = object()
+        submitted = [0]
+        errors = []
+
+        def read(executor):
+            try:
+                for item in items:
+                    slots.acquire()
+                    submitted[0] += 1
+                    future = executor.submit(func, item)
+                    if ordered:
+                        results.put(future)
+                    else:
+                        future.add_done_callback(results.put)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                results.put(done)
+
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            reader = threading.Thread(target=read, args=(executor,))
+            reader.daemon = True
+            reader.start()
+
+            # Unordered futures can land in the queue after `done`, so
+            # keep going until every slot has been given back.
+            finished = False
+            returned = 0
+            while not finished or returned < submitted[0]:
+                future = results.get()
+                if future is done:
+                    finished = True
+                    continue
+                returned += 1
+                slots.release()
+                yield future.result()
+
+            if errors:
+                raise errors[0]
+
+    def serializer(self, format=None):
+        """
+        Returns a serializer for `format`, one of the names in
+        `serializers.serializer_classes`, or `serializer_class` by
+        default.
+        """
+        if format is None:
+            return self.serializer_class()
+        return serializers.get_serializer_class(format)()
+
+    def serialize(self, data, format=None):
+        return self.serializer(format).serialize(data)
+
+
+class Titles(object):
+    """
+    The link titles of one message from `Handler.parse_deferred`, being
+    fetched in the background.
+    """
+    def __init__(self, data, pending):
+        self.data = data
+        # (key, index, url, future) for every link in `data`.
+        self.pending = pending
+
+    def add_callback(self, callback):
+        """
+        Calls `callback(key, index, url, title)` as each title is fetched.
+
+        Titles that are already in are delivered straight away, on this
+        thread; the rest on the thread that fetched them.
+        """
+        for key, index, url, future in self.pending:
+            future.add_done_callback(functools.partial(
+                self.deliver, callback, key, index, url))
+
+    @staticmethod
+    def deliver(callback, key, index, url, future):
+        callback(key, index, url, fetched_title(future))
+
+    def done(self):
+        return all(future.done() for key, index, url, future in self.pending)
+
+    def result(self, timeout=None):
+        """
+        Waits for every title and returns the message's data with them
+        filled in.
+
+        Raises `concurrent.futures.TimeoutError` if they aren't all in
+        within `timeout` seconds.
+        """
+        from concurrent.futures import wait
+
+        wait([future for key, index, url, future in self.pending], timeout)
+        data = dict(self.data)
+        for key in set(key for key, index, url, future in self.pending):
+            data[key] = list(data[key])
+        for key, index, url, future in self.pending:
+            data[key][index] = {"url": url, "title": fetched_title(future)}
+        return data
+
+
+class IncrementalParser(object):
+    """
+    Parses one message that arrives in chunks, such as reads from a
+    socket, without reassembling it first.
+
+    No token contains whitespace, so everything up to the last
+    whitespace fed so far is scanned as it arrives. Only the word after
+    it is carried over to the next chunk, so tokens split between chunks
+    are still found. Link titles start fetching as soon as their links
+    are found.
+
+    Chunks may be text or utf-8 bytes. `close` returns what
+    `Handler.parse` would for the whole message.
+    """
+    def __init__(self, handler):
+        # A batch, so `close` reuses the fetches `feed` started, even
+        # finished ones with no title cache: one message can't hold many.
+        self.handler = handler.batch()
+        for parser in self.handler.parsers.values():
+            if isinstance(parser, parsers.LinkParser):
+                parser.keep_finished = True
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        # The unfinished last word, in the pieces it arrived in.
+        self.tail = []
+        # Each parser's key to its raw matches so far.
+        self.found = {}
+
+    def feed(self, chunk):
+        """
+        Parses `chunk`, and returns `{key: matches}` for the tokens it
+        completed. Matches are raw, as each parser's `matches` returns
+        them.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        end = max(chunk.rfind(space) for space in WHITESPACE) + 1
+        if not end:
+            self.tail.append(chunk)
+            return {}
+        self.tail.append(chunk[:end])
+        text = ''.join(self.tail)
+        self.tail = [chunk[end:]]
+        return self.scan(text)
+
+    def close(self, timeout=None):
+        """
+        Parses what's left and returns the message's data, as
+        `Handler.parse` does, waiting at most `timeout` seconds for
+        titles.
+        """
+        deadline = deadline_after(timeout)
+        self.tail.append(self.decoder.decode(b'', True))
+        self.scan(''.join(self.tail))
+        self.tail = []
+
+        data = {}
+        for key, parser in self.handler.parsers.items():
+            matches = self.found.get(key)
+            if matches and not self.handler.is_deferred(parser):
+                matches = parser.clean_matches(matches)
+            if matches:
+                data[key] = matches
+        return self.handler.resolve(data, deadline)
+
+    def scan(self, text):
+        found = {}
+        if not text:
+            return found
+        for key, parser in self.handler.parsers.items():
+            matches = parser.matches(text)
+            if not matches:
+                continue
+            if self.handler.titles and self.handler.is_deferred(parser):
+                parser.fetch_titles(matches)
+            found[key] = matches
+            self.found.setdefault(key, []).extend(matches)
+        return found
+
+
+# Whitespace as the parsers' regexes see it; no token contains any.
+WHITESPACE = ' \t\n\r\f\v'
+
+
+def load_class(spec):
+    """
+    Returns the class `spec` names, as `"package.module.Class"`, or
+    `spec` itself if it's already a class.
+    """
+    if isinstance(spec, type):
+        return spec
+    module, _, name = spec.rpartition('.')
+    return getattr(importlib.import_module(module), name)
+
+
+def untitled(urls):
+    """Returns links for `urls` with no titles."""
+    return [{"url": url, "title": None} for url in urls]
+
+
+def fetched_title(future):
+    """
+    Returns the title a finished fetch `future` holds, or '' if the fetch
+    raised, as `parsers.fetch_title` does for pages it can't read.
+
+    Raising instead would be lost inside a done callback.
+    """
+    if future.exception() is not None:
+        return ''
+    return future.result()
+
+
+def deadline_after(timeout):
+    """Returns the `time.time()` that's `timeout` seconds from now."""
+    if timeout is None:
+        return None
+    return time.time() + timeout
+
+
+def map_chunks(func, items, workers, chunk_size, *args):
+    """
+    Yields `func(*args, chunk)` for each `chunk_size` chunk of `items`, in
+    order, called in `workers` processes.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    items = iter(items)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # Keep every worker busy without reading all the input.
+            while len(pending) < 2 * workers:
+                chunk = list(islice(items, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(func, *(args + (chunk,))))
+            if not pending:
+                break
+            yield pending.popleft().result()
+
+
+# One handler per handler class in each worker process.
+_worker_handlers = {}
+
+
+def scan_chunk(handler_class, strings):
+    """Scans a chunk of messages in a `scan_parallel` worker."""
+    handler = _worker_handlers.get(handler_class)
+    if handler is None:
+        handler = _worker_handlers[handler_class] = handler_class()
+    return handler.scan_batch(strings)
+
+
+def parse(string, format='json', timeout=None, titles=True):
+    handler = Handler(titles)
+    return handler.serialize(handler.parse(string, timeout), format)
+
+
+def parse_many(strings, format='json', timeout=None, titles=True):
+    handler = Handler(titles)
+    serializer = handler.serializer(format)
+    for data in handler.parse_many(strings, timeout=timeout):
+        yield serializer.serialize(data)
 
 
-def parse(string, format='json'):
-    handler = Handler()
-    return handler.serialize(handler.parse(string))
+def parse_parallel(strings, workers=None, format='json', timeout=None,
+                   titles=True):
+    handler = Handler(titles)
+    serializer = handler.serializer(format)
+    for data in handler.parse_parallel(
+            strings, workers=workers, timeout=timeout):
+        yield serializer.serialize(data)
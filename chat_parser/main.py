@@ -1,12 +1,64 @@
 """Chat Parse.
 
 Usage:
-  chatparse [-v | --verbose]
+  chatparse [-v | --verbose] [(--lines | --ndjson)
+            ([--unordered] [--workers=<n>] | --deferred)] [--input=<path>]
+            [--format=<format>] [--timeout=<seconds>] [--cache=<path>]
+            [--no-titles] [--memoize] [--stats]
+  chatparse serve [-v | --verbose] [--host=<host>]
+            [--port=<port> | --socket=<path>] [--threads=<n>] [--queue=<n>]
+            [--cache=<path>] [--memoize] [--stats]
+  chatparse aggregate [-v | --verbose] [--input=<path>] [--workers=<n>]
+            [--capacity=<n>] [--top=<k>] [--save=<path>]
+  chatparse merge [-v | --verbose] [--top=<k>] [--save=<path>] <sketch>...
   chatparse (-h | --help)
   chatparse --version
 
 Options:
   -v --verbose  Show DEBUG logs.
+  --lines       Parse each line as its own message and print one compact
+                JSON object per line as soon as it's ready.
+  --ndjson      Same as --lines.
+  --unordered   With --lines, print results as they finish instead of in
+                input order.
+  --workers=<n>  With --lines, scan lines in <n> processes. Titles are still
+                fetched by this process, once per distinct link. With
+                aggregate, count lines in <n> processes.
+  --deferred    With --lines, print each message as soon as it's parsed,
+                with link titles null, then a record per title as it's
+                fetched. Records carry the message's line number.
+  --input=<path>
+                Read messages, one per line, from a file instead of stdin.
+                The file is memory-mapped and scanned in place, and
+                implies --lines unless aggregating. When parsing, it can't
+                be combined with --workers or --deferred.
+  --format=<format>
+                Output format: json (indented), compact, ndjson or binary
+                (length-prefixed records). Defaults to json, or ndjson with
+                --lines.
+  --timeout=<seconds>
+                Give up on a message's link titles after <seconds> and print
+                it with the missing titles null. Fetches carry on in the
+                background to fill the cache.
+  --cache=<path>
+                Cache link titles in a sqlite database shared between runs.
+  --no-titles   Don't fetch link titles; print them as null. Skips loading
+                the HTTP and HTML libraries.
+  --memoize     Remember the results of repeated messages, for as long as
+                their titles are cached. When parsing, it can't be
+                combined with --input, --workers or --deferred.
+  --stats       Print timings and counts for each stage to stderr.
+  --host=<host>  Address for serve to listen on [default: 127.0.0.1].
+  --port=<port>  Port for serve to listen on [default: 8080].
+  --socket=<path>
+                Serve on a Unix socket at <path> instead of a TCP port.
+  --threads=<n>  Requests serve parses at once [default: 8].
+  --queue=<n>   Requests serve holds waiting for a thread before
+                answering 503 [default: 64].
+  --capacity=<n>  Items aggregate keeps counts for, per category. Counts
+                are off by at most messages / <n> [default: 1000].
+  --top=<k>     Items to list per category [default: 10].
+  --save=<path>  Save the counts, to merge with other runs' later.
   -h --help     Show this screen.
   --version     Show version.
 
@@ -14,13 +66,24 @@ Examples:
   cat examples/all.txt | chatparse
   cat examples/* | chatparse
   echo "@bob, come here real quick" | chatparse
+  cat examples/* | chatparse --lines
+  cat examples/* | chatparse --lines --deferred
+  cat examples/* | chatparse --lines --no-titles
+  chatparse serve --port 8080 --cache ~/.chatparse.db
+  curl --data-binary @examples/all.txt localhost:8080/parse
+  chatparse aggregate --input january.log --save january.json
+  chatparse merge january.json february.json --top 20
 """
+import json
 import logging
 import sys
 
 from docopt import docopt
 
-from chat_parser import parse
+from chat_parser import caches, parsers, serializers, stats
+from chat_parser.handlers import Handler
+
+logger = logging.getLogger(__name__)
 
 
 def setup_logging(verbose=False):
@@ -38,9 +101,131 @@ def main():
     args = docopt(__doc__, version='Chat Parse 0.0.1')
     setup_logging(args['--verbose'])
 
-    lines = ''.join(sys.stdin.readlines())
+    if args['--stats']:
+        recorder = stats.Recorder()
+        recorder.install()
+
+    if args['--cache']:
+        parsers.LinkParser.title_cache = caches.SQLiteCache(args['--cache'])
+
+    if args['serve']:
+        serve(args)
+    elif args['aggregate'] or args['merge']:
+        aggregate(args)
+    else:
+        parse_input(args)
+
+    parsers.shutdown()
+    logger.debug("Title cache: {}".format(
+        parsers.LinkParser.title_cache.stats()))
+
+    if args['--stats']:
+        sys.stderr.write(recorder.report() + '\n')
+
+
+def parse_input(args):
+    """Parses stdin, or the --input file, and prints the results."""
+    streaming = args['--lines'] or args['--ndjson'] or args['--input']
+    format = args['--format'] or ('ndjson' if streaming else 'json')
+    try:
+        serializer = serializers.get_serializer_class(format)()
+    except ValueError as e:
+        sys.exit(e)
+
+    if args['--input'] and (args['--workers'] or args['--deferred']):
+        sys.exit("--input can't be combined with --workers or --deferred.")
+    if args['--memoize'] and (
+            args['--input'] or args['--workers'] or args['--deferred']):
+        sys.exit("--memoize can't be combined with --input, --workers or "
+                 "--deferred.")
+
+    memo = caches.ParseCache() if args['--memoize'] else None
+    handler = Handler(titles=not args['--no-titles'], memo=memo)
+    timeout = args['--timeout'] and float(args['--timeout'])
+    if args['--input']:
+        parse_file(handler, args['--input'], serializer,
+                   ordered=not args['--unordered'], timeout=timeout)
+    elif args['--deferred']:
+        write_lines(handler.parse_deferred_stream(stdin_lines()),
+                    serializer)
+    elif streaming:
+        workers = args['--workers'] and int(args['--workers'])
+        parse_lines(handler, serializer, ordered=not args['--unordered'],
+                    workers=workers, timeout=timeout)
+    else:
+        lines = ''.join(sys.stdin.readlines())
+        write_lines([handler.parse(lines, timeout)], serializer)
+
+
+def aggregate(args):
+    """Prints the top items of a log, or of saved counts."""
+    from chat_parser import aggregates
+
+    capacity = int(args['--capacity'])
+    if args['merge']:
+        aggregator = aggregates.Aggregator(capacity)
+        for path in args['<sketch>']:
+            with open(path) as f:
+                aggregator.merge(aggregates.Aggregator.from_dict(json.load(f)))
+    elif args['--input']:
+        with open(args['--input']) as f:
+            aggregator = aggregates.aggregate(
+                (line.rstrip('\n') for line in f), capacity,
+                workers=args['--workers'] and int(args['--workers']))
+    else:
+        aggregator = aggregates.aggregate(
+            stdin_lines(), capacity,
+            workers=args['--workers'] and int(args['--workers']))
+
+    if args['--save']:
+        with open(args['--save'], 'w') as f:
+            json.dump(aggregator.to_dict(), f)
+    report = aggregator.report(int(args['--top']))
+    write_lines([report], serializers.JSONSerializer())
+
+
+def serve(args):
+    """Runs the parse server until interrupted."""
+    from chat_parser import server
+
+    server.serve(host=args['--host'], port=int(args['--port']),
+                 path=args['--socket'], workers=int(args['--threads']),
+                 queue_size=int(args['--queue']), memoize=args['--memoize'])
+
+
+def parse_lines(handler, serializer, ordered=True, workers=None,
+                timeout=None):
+    """Streams stdin through the parser one line at a time."""
+    lines = stdin_lines()
+    if workers:
+        results = handler.parse_parallel(
+            lines, workers=workers, ordered=ordered, timeout=timeout)
+    else:
+        results = handler.parse_stream(
+            lines, ordered=ordered, timeout=timeout)
+
+    write_lines(results, serializer)
+
+
+def stdin_lines():
+    # `for line in sys.stdin` reads ahead, which stalls interactive input.
+    return (line.rstrip('\n') for line in iter(sys.stdin.readline, ''))
+
+
+def parse_file(handler, path, serializer, ordered=True, timeout=None):
+    """Parses each line of the file at `path`."""
+    results = handler.parse_file(path, ordered=ordered, timeout=timeout)
+    write_lines(results, serializer)
+
 
-    print parse(lines)
+def write_lines(results, serializer):
+    out = sys.stdout
+    # Binary records go to the underlying byte stream on Python 3.
+    if isinstance(serializer.terminator, bytes):
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+    for data in results:
+        serializer.dump(data, out)
+        out.flush()
 
 
 if __name__ == "__main__":
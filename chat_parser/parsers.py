@@ -1,14 +1,64 @@
 from __future__ import unicode_literals
 
+import copy
+import functools
 import logging
 import re
+import threading
+import time
+from bisect import bisect_right
 
-from concurrent.futures import ThreadPoolExecutor
-import requests
-from lxml import html
+from . import caches
+from . import stats
+from . import tokenizers
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for a page to start answering.
+TIMEOUT = 4
+
+# Most pages declare their <title> within the first few KB.
+MAX_TITLE_BYTES = 64 * 1024
+CHUNK_SIZE = 4 * 1024
+# Finishing a small body is cheaper than a new connection to the host.
+DRAIN_BYTES = 64 * 1024
+
+# Number of hosts to keep connections for, and connections per host.
+POOL_HOSTS = 32
+POOL_HOST_SIZE = 4
+
+# Query parameters that only record where a click came from, dropped from
+# links before their titles are fetched. Names ending in * are prefixes.
+TRACKING_PARAMS = (
+    'utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_hsenc', '_hsmi', 'ref_src',
+)
+
+DEFAULT_PORTS = {'http': '80', 'https': '443', 'ftp': '21', 'ftps': '990'}
+
+SCHEME = re.compile('([a-zA-Z][a-zA-Z0-9+.-]*)://')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class LazyRegex(object):
+    """
+    A class attribute that compiles `pattern` the first time it's read.
+
+    Case insensitive character classes with wide unicode ranges take a
+    large part of a second to compile on Python 2.
+    """
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self.regex = None
+
+    def __get__(self, instance, owner):
+        if self.regex is None:
+            self.regex = re.compile(self.pattern, self.flags)
+        return self.regex
+
 
 class Parser(object):
     """
@@ -22,6 +72,13 @@ class Parser(object):
     """
     regex = None
 
+    # Whether `regex` finds the same tokens in messages joined by
+    # `scanners.join` as in each message alone: no token can contain a
+    # newline, and nothing depends on where the string starts or ends
+    # other than `^` and `$` under re.MULTILINE.
+    joinable = False
+
+    @stats.timed('parser.{}')
     def parse(self, string):
         if not self.regex:
             raise NotImplementedError(".regex must be defined.")
@@ -39,12 +96,42 @@ class Parser(object):
         """Manipulate matches before returning."""
         return list(set(map(lambda s: s.lower(), matches)))
 
+    def batch_matches(self, buffer, starts):
+        """
+        Returns the matches of each message in a batch, as `matches`
+        would for each one on its own.
+
+        `buffer` is the messages joined by `scanners.join`, and `starts`
+        where each one starts in it. Returns None if this parser can only
+        match one message at a time.
+        """
+        cls = type(self)
+        if (not self.joinable or not self.regex or
+                cls.parse != Parser.parse or cls.matches != Parser.matches):
+            return None
+
+        matches = [[] for start in starts]
+        for m in self.regex.finditer(buffer):
+            matches[bisect_right(starts, m.start(1)) - 1].append(m.group(1))
+        return matches
+
+    def byte_matches(self, data, pos, endpos):
+        """
+        Returns `(start, token)` for each match in the utf-8 encoded
+        `data[pos:endpos]`, with tokens still encoded, or None if this
+        parser can only match text.
+
+        Used by `Handler.scan_file` for parsers it can't fuse.
+        """
+        return None
+
 
 class MentionParser(Parser):
     """
     Finds all @mentions in a string.
     """
     regex = re.compile('@(\w+)', re.IGNORECASE | re.MULTILINE)
+    joinable = True
 
 
 class EmoticonParser(Parser):
@@ -52,6 +139,7 @@ class EmoticonParser(Parser):
     Finds all (emoticons) in a string.
     """
     regex = re.compile('\(([a-zA-Z0-9]{1,15})\)', re.IGNORECASE | re.MULTILINE)
+    joinable = True
 
 
 class LinkParser(Parser):
@@ -61,8 +149,12 @@ class LinkParser(Parser):
     These guys are smarter than me:
         https://mathiasbynens.be/demo/url-regex
         https://gist.github.com/dperini/729294#comment-1296121
+
+    `regex` defines what a link is, but backtracks badly on long runs of
+    letters, so `matches` finds the same links with the linear time
+    `tokenizers.find_urls`, and `regex` is only compiled if it's used.
     """
-    regex = re.compile(
+    regex = LazyRegex(
         '(?:\s|^)'
         '('
             '(?:(?:https?|s?ftp)://)?'  # scheme
@@ -78,59 +170,484 @@ class LinkParser(Parser):
             '(?:/\S*)?'  # resource
         ')',
         re.IGNORECASE | re.MULTILINE)
+    joinable = True
 
-    def clean_matches(self, matches):
-        """Fetch the url titles."""
-        data = []
+    # Seconds to spend looking for links in one message before giving up
+    # on the rest of it. None for no limit.
+    scan_budget = None
+
+    # Titles fetched at once, in total and from any one host.
+    max_workers = 4
+    max_per_host = 2
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            for url in matches:
-                future = executor.submit(fetch_title, url)
-                data.append({
-                    "url": url,
-                    "title": future.result(),
-                })
+    # Set to None to always fetch titles.
+    title_cache = caches.MemoryCache()
 
-        return data
+    # Query parameters dropped by `canonical`.
+    tracking_params = TRACKING_PARAMS
 
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
 
-def fetch_title(url):
+    @classmethod
+    def scheduler(cls):
+        """
+        Returns the fetch scheduler shared by every LinkParser.
+
+        The scheduler is created on first use and reused across messages,
+        so at most `max_workers` titles are ever fetched at once, and at
+        most `max_per_host` from one host.
+        """
+        if cls._scheduler is None:
+            from . import schedulers
+
+            with cls._scheduler_lock:
+                if cls._scheduler is None:
+                    cls._scheduler = schedulers.FetchScheduler(
+                        max_workers=cls.max_workers,
+                        max_per_host=cls.max_per_host,
+                        default_wait=TIMEOUT)
+        return cls._scheduler
+
+    # Set by `batch` to share fetches between the messages of a batch.
+    batch_titles = None
+    # Set on a batch to share finished fetches too, not just those in
+    # flight, for a batch too short to grow without bound.
+    keep_finished = False
+
+    def batch(self):
+        """
+        Returns a copy of this parser that fetches each url only once.
+
+        Every message parsed by the copy shares its fetches, so a url
+        linked from many messages is fetched once however many of them
+        are in flight. Finished fetches are dropped, so a batch as long
+        as a file holds no more than the fetches in flight; their titles
+        come from `title_cache`.
+        """
+        parser = copy.copy(self)
+        parser.batch_titles = {}
+        parser.batch_lock = threading.Lock()
+        return parser
+
+    def matches(self, string):
+        return tokenizers.find_urls(string, self.scan_budget)
+
+    def batch_matches(self, buffer, starts):
+        # A budget is per message, so can't be kept over a batch.
+        if (not self.joinable or self.scan_budget is not None or
+                type(self).matches != LinkParser.matches):
+            return None
+
+        matches = [[] for start in starts]
+        for start, url in tokenizers.find_url_starts(buffer):
+            matches[bisect_right(starts, start) - 1].append(url)
+        return matches
+
+    def byte_matches(self, data, pos, endpos):
+        if (self.scan_budget is not None or
+                type(self).matches != LinkParser.matches):
+            return None
+        return tokenizers.find_url_starts(
+            data, pos, endpos, tokenizers.BYTES)
+
+    def canonical(self, url):
+        """
+        Returns the url that `url` and every link equivalent to it are
+        fetched and cached as.
+        """
+        return canonical_url(url, self.tracking_params)
+
+    def submit(self, url, deadline=None):
+        """
+        Returns a future for the title of `url`, already done if it's in
+        `title_cache`.
+
+        Titles wanted by an earlier `deadline` are fetched first.
+        """
+        if self.batch_titles is None:
+            future = self.cached_title(url)
+            if future is None:
+                future = self.scheduler().submit(
+                    url, self.load_title, deadline)
+            return future
+
+        with self.batch_lock:
+            future = self.batch_titles.get(url)
+            if future is None:
+                # Checked under the lock: a fetch is only forgotten once
+                # its title is cached.
+                future = self.cached_title(url)
+            if future is not None:
+                return future
+            future = self.scheduler().submit(url, self.load_title, deadline)
+            self.batch_titles[url] = future
+        if not self.keep_finished:
+            # Outside the lock: a future that's already done calls back
+            # straight away.
+            future.add_done_callback(
+                functools.partial(self.forget_title, url))
+        return future
+
+    def forget_title(self, url, future):
+        """Drops the finished fetch `future` of `url` from the batch."""
+        with self.batch_lock:
+            if self.batch_titles.get(url) is future:
+                del self.batch_titles[url]
+
+    def load_title(self, url):
+        """Fetches the title of `url` and caches it."""
+        title = fetch_title(url)
+        if self.title_cache is not None:
+            self.title_cache.set(url, title)
+        return title
+
+    def fetch_titles(self, matches, deadline=None):
+        """
+        Returns a future for the title of each url.
+
+        Urls are fetched and cached by their `canonical` form, so links
+        that differ only in case, scheme, port, fragment or tracking
+        parameters share one fetch. Titles in `title_cache` come back as
+        futures that are already done. The rest are all submitted to the
+        shared scheduler at once, so they're fetched concurrently.
+        """
+        futures = []
+        found = {}
+        for url in matches:
+            url = self.canonical(url)
+            future = found.get(url)
+            if future is None:
+                future = found[url] = self.submit(url, deadline)
+            futures.append(future)
+        return futures
+
+    def cached_title(self, url):
+        """Returns a done future for the cached title of `url`, or None."""
+        from concurrent.futures import Future
+
+        if self.title_cache is None:
+            return None
+        try:
+            title = self.title_cache.get(url)
+        except KeyError:
+            return None
+        future = Future()
+        future.set_result(title)
+        return future
+
+    def clean_matches(self, matches, deadline=None):
+        """
+        Fetch the url titles.
+
+        Waits for every title from `fetch_titles` and returns them in the
+        order the urls were matched. With a `deadline`, in `time.time()`
+        seconds, titles that aren't in by then are returned as None. Their
+        fetches carry on and fill the title cache.
+        """
+        futures = self.fetch_titles(matches, deadline)
+        if deadline is None:
+            return [
+                {"url": url, "title": future.result()}
+                for url, future in zip(matches, futures)
+            ]
+
+        from concurrent.futures import wait
+
+        wait(futures, max(0, deadline - time.time()))
+        titles = []
+        pending = 0
+        for url, future in zip(matches, futures):
+            if future.done():
+                title = future.result()
+            else:
+                title = None
+                pending += 1
+            titles.append({"url": url, "title": title})
+        if pending:
+            stats.count('links.pending', pending)
+        return titles
+
+
+def fetch_title(url, max_bytes=None):
     """
     Fetches the title for a given url.
 
+    Only the start of the page is downloaded: reading stops once the
+    <title> element closes or `max_bytes` (default `MAX_TITLE_BYTES`)
+    have been read. Responses that aren't HTML aren't read at all.
+
     If the url is not a web page or there is an error fetching the
     page, an empty string, '', is returned.
     """
     logger.debug("Fetching title for: {}".format(url))
 
+    url = web_url(url)
+    if url is None:
+        return ''
+
+    import requests
+    from .schedulers import url_host
+
+    host = url_host(url)
+    start = time.time()
+    try:
+        try:
+            page = session().get(url, timeout=TIMEOUT, stream=True)
+        except requests.exceptions.Timeout:
+            logger.info("Fetching url: {} timed out.".format(url))
+            stats.count('fetch.timeouts', host=host)
+            return ''
+        except requests.exceptions.RequestException:
+            logger.info("Fetching url: {} failed.".format(url))
+            stats.count('fetch.errors', host=host)
+            return ''
+
+        # Recorded either way: a timer may be added before the read ends.
+        read_start = time.time()
+        if stats.timers:
+            stats.timing('fetch.connect', read_start - start, host=host)
+        try:
+            return read_title(page, url, max_bytes)
+        finally:
+            release(page)
+            if stats.timers:
+                stats.timing('fetch.read', time.time() - read_start, host=host)
+    finally:
+        if stats.timers:
+            stats.timing('fetch_title', time.time() - start, host=host)
+
+
+def web_url(url):
+    """
+    Returns `url` with a scheme, or None if it isn't a web url.
+    """
     scheme = '(https?|ftps?)://'
     if not re.match(scheme, url):
         url = 'http://' + url
 
     if not url.startswith('http'):
-        return ''
+        return None
+
+    return url
+
+
+def canonical_url(url, tracking_params=TRACKING_PARAMS):
+    """
+    Returns `url` in the form that equivalent links share.
+
+    The scheme and host are lowercased, and the scheme is `http` if
+    there isn't one. Default ports, the fragment and any query parameter
+    named in `tracking_params` are dropped. The path and the rest of the
+    query are left as they are, as servers may treat their case and
+    encoding as meaningful.
+    """
+    url = url.partition('#')[0]
+    scheme = SCHEME.match(url)
+    if scheme:
+        rest = url[scheme.end():]
+        scheme = scheme.group(1).lower()
+    else:
+        scheme, rest = 'http', url
+
+    end = len(rest)
+    for delimiter in '/?':
+        index = rest.find(delimiter, 0, end)
+        if index != -1:
+            end = index
+    authority, rest = rest[:end], rest[end:]
+    userinfo, at, host = authority.rpartition('@')
+    host, colon, port = host.partition(':')
+    if port == DEFAULT_PORTS.get(scheme):
+        colon = port = ''
+    authority = userinfo + at + host.lower() + colon + port
+
+    path, question, query = rest.partition('?')
+    if query and tracking_params:
+        tracking = tracking_regex(tuple(tracking_params))
+        query = '&'.join(
+            param for param in query.split('&')
+            if not tracking.match(param.partition('=')[0]))
+        question = question if query else ''
+
+    return scheme + '://' + authority + path + question + query
+
+
+_tracking_regexes = {}
+
+
+def tracking_regex(tracking_params):
+    """Returns a regex matching the names in `tracking_params`, cached."""
+    regex = _tracking_regexes.get(tracking_params)
+    if regex is None:
+        regex = re.compile('(?:{})$'.format('|'.join(
+            re.escape(name[:-1]) + '.*' if name.endswith('*')
+            else re.escape(name)
+            for name in tracking_params)))
+        _tracking_regexes[tracking_params] = regex
+    return regex
 
+
+def read_title(page, url, max_bytes=None):
+    """
+    Reads the title from a streamed response, a chunk at a time.
+    """
+    import requests
+    from .schedulers import url_host
+
+    content_type = page.headers.get('Content-Type')
+    host = url_host(url)
+    reader = None
     try:
-        page = requests.get(url, timeout=4)
+        reader = TitleReader(content_type, max_bytes)
+        if reader.skipped:
+            logger.info("Skipping non HTML url: {} ({})".format(
+                url, content_type))
+            stats.count('fetch.skipped', host=host)
+            return ''
+
+        for chunk in page.iter_content(CHUNK_SIZE):
+            reader.feed(chunk)
+            if reader.done:
+                break
+        return reader.close()
     except requests.exceptions.RequestException:
-        logger.info("Fetching url: {} timed out.".format(url))
+        logger.info("Reading url: {} failed.".format(url))
+        stats.count('fetch.errors', host=host)
         return ''
-
-    try:
-        # XXX: I assume this can throw a ParseError, but I can't find the
-        # stupid documentation on it.
-        # Supposedly:
-        #   "It will not raise an exception on parser errors. You should
-        #   use libxml2 version 2.6.21 or newer to take advantage of this
-        #   feature."
-        # But I find that hard to believe.
-        tree = html.fromstring(page.text)
-    except:
+    except Exception:
         logger.info("Error parsing page from: {}".format(url))
+        stats.count('fetch.parse_errors', host=host)
         return ''
+    finally:
+        if reader is not None:
+            logger.debug("Read {} bytes from: {}".format(reader.read, url))
+            stats.count('fetch.bytes', reader.read, host=host)
 
-    el = tree.find(".//title")
-    if el is None:
-        return ''
 
-    return el.text
+def release(page):
+    """
+    Gives the page's connection back to the pool.
+
+    A connection can only be reused once its body has been read, so short
+    remainders are drained. Anything longer is dropped along with the
+    connection.
+    """
+    import requests
+
+    try:
+        remaining = int(page.headers.get('Content-Length')) - page.raw.tell()
+    except (TypeError, ValueError, AttributeError):
+        remaining = None
+
+    if remaining is not None and 0 <= remaining <= DRAIN_BYTES:
+        try:
+            for chunk in page.iter_content(CHUNK_SIZE):
+                pass
+        except requests.exceptions.RequestException:
+            pass
+    page.close()
+
+
+def session():
+    """
+    Returns the requests session shared by every title fetch.
+
+    Connections are kept alive and reused across messages, for up to
+    `POOL_HOSTS` hosts with `POOL_HOST_SIZE` connections each.
+    """
+    global _session
+    if _session is None:
+        import requests
+
+        with _session_lock:
+            if _session is None:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=POOL_HOSTS, pool_maxsize=POOL_HOST_SIZE)
+                _session = requests.Session()
+                _session.mount('http://', adapter)
+                _session.mount('https://', adapter)
+    return _session
+
+
+def shutdown():
+    """
+    Waits for outstanding title fetches and closes pooled connections.
+
+    The pool and session are created again if titles are fetched later.
+    """
+    global _session
+    with LinkParser._scheduler_lock:
+        if LinkParser._scheduler is not None:
+            LinkParser._scheduler.shutdown()
+            LinkParser._scheduler = None
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+class TitleReader(object):
+    """
+    Finds a page's title from chunks of its body as they arrive.
+
+    `content_type` is the response's Content-Type header. Responses that
+    aren't HTML are `skipped` and shouldn't be read at all. Once `done`,
+    either the <title> has closed or `max_bytes` have been fed, and
+    `close` returns the title.
+    """
+    def __init__(self, content_type=None, max_bytes=None):
+        import requests.utils
+        from lxml import etree
+
+        content_type = (content_type or '').lower()
+        self.skipped = bool(content_type) and 'html' not in content_type
+        self.max_bytes = max_bytes or MAX_TITLE_BYTES
+        self.read = 0
+
+        # Without a charset in the headers lxml looks for a <meta> one.
+        encoding = None
+        if 'charset' in content_type:
+            encoding = requests.utils.get_encoding_from_headers(
+                {'content-type': content_type})
+
+        self.target = TitleTarget()
+        self.parser = etree.HTMLParser(target=self.target, encoding=encoding)
+
+    @property
+    def done(self):
+        return self.target.done or self.read >= self.max_bytes
+
+    def feed(self, chunk):
+        chunk = chunk[:self.max_bytes - self.read]
+        self.read += len(chunk)
+        self.parser.feed(chunk)
+
+    def close(self):
+        return self.parser.close()
+
+
+class TitleTarget(object):
+    """
+    An lxml parser target that collects the text of the first <title>.
+    """
+    def __init__(self):
+        self.text = []
+        self.in_title = False
+        self.done = False
+
+    def start(self, tag, attrib):
+        if tag == 'title' and not self.done:
+            self.in_title = True
+
+    def end(self, tag):
+        if tag == 'title' and self.in_title:
+            self.in_title = False
+            self.done = True
+
+    def data(self, data):
+        if self.in_title:
+            self.text.append(data)
+
+    def close(self):
+        return ''.join(self.text)
@@ -0,0 +1,112 @@
+"""
+A compact representation of parsed messages.
+
+`Handler.parse` returns a dict of lists per message, and a dict per link.
+When millions of results are held at once, the dicts and lists outweigh
+the strings in them. `Result` holds the same data in slots and tuples,
+with mentions and emoticons interned so each distinct one is stored
+once. It's converted to the usual dict by `to_dict`, which the
+serializers call when they write it out.
+"""
+from collections import namedtuple
+
+try:
+    from sys import intern as _intern
+except ImportError:  # Python 2
+    _intern = intern
+
+# Unicode mentions and emoticons on Python 2, which its `intern` doesn't
+# take. The table is emptied once it holds `MAX_STRINGS`, so a log of
+# distinct names can't grow it without bound.
+MAX_STRINGS = 100000
+_strings = {}
+
+
+def intern_string(string):
+    """
+    Returns the shared copy of `string`, sharing it if it's new.
+
+    Native strings go to `intern`, which frees them once nothing else
+    holds them.
+    """
+    if type(string) is str:
+        return _intern(string)
+    if len(_strings) >= MAX_STRINGS:
+        _strings.clear()
+    return _strings.setdefault(string, string)
+
+
+class Link(namedtuple('Link', 'url title')):
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"url": self.url, "title": self.title}
+
+
+class Result(object):
+    """
+    One parsed message, as tuples in slots.
+
+    Keys other than mentions, emoticons and links, from custom parsers,
+    are kept as they are in `extra`.
+    """
+    __slots__ = ('mentions', 'emoticons', 'links', 'extra')
+
+    def __init__(self, mentions=(), emoticons=(), links=(), extra=None):
+        self.mentions = mentions
+        self.emoticons = emoticons
+        self.links = links
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data, intern=True):
+        """
+        Returns the `Result` for `data` in the shape `parse` returns.
+
+        Without `intern`, mentions and emoticons aren't shared with
+        other results.
+        """
+        extra = None
+        for key in data:
+            if key not in cls.__slots__:
+                extra = dict(
+                    (key, value) for key, value in data.items()
+                    if key not in cls.__slots__)
+                break
+        mentions = data.get('mentions', ())
+        emoticons = data.get('emoticons', ())
+        if intern:
+            mentions = map(intern_string, mentions)
+            emoticons = map(intern_string, emoticons)
+        return cls(
+            mentions=tuple(mentions),
+            emoticons=tuple(emoticons),
+            links=tuple(
+                Link(link['url'], link['title'])
+                for link in data.get('links', ())),
+            extra=extra,
+        )
+
+    def to_dict(self):
+        """Returns this result in the shape `parse` returns, as a new dict."""
+        data = dict(self.extra) if self.extra else {}
+        if self.mentions:
+            data['mentions'] = list(self.mentions)
+        if self.emoticons:
+            data['emoticons'] = list(self.emoticons)
+        if self.links:
+            data['links'] = [link.to_dict() for link in self.links]
+        return data
+
+    def __eq__(self, other):
+        if isinstance(other, Result):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Result({!r})'.format(self.to_dict())
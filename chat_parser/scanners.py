@@ -0,0 +1,166 @@
+from __future__ import unicode_literals
+
+import re
+
+from . import stats
+from .parsers import Parser
+
+# Joins the messages of a batch. No token contains a newline, so none
+# can run from one message into the next, and each message starts after
+# whitespace at the start of a line, as `(?:\s|^)` in `LinkParser.regex`
+# and the tokenizer's word boundaries expect.
+SEPARATOR = '\n'
+
+
+class Scanner(object):
+    """
+    Finds the matches of several parsers in a single pass over a string.
+
+    The parsers' regexes are combined into one pattern. Each one is
+    wrapped in its own lookahead, so tokens of different kinds may
+    overlap (an (emoticon) inside a link, an @mention inside an email
+    address) exactly as they do when every parser scans on its own.
+
+    Only parsers that use the stock `Parser.parse` and `Parser.matches`
+    with a plain `regex`, and share the regex flags of the other parsers,
+    can be fused. Everything else is left out of `scan` and should be
+    parsed the usual way.
+
+    `Handler` doesn't use it. On chat-sized messages the lookaheads make
+    one fused pass several times slower than each parser's own regex,
+    whose engine can skip ahead to its first literal
+    (`python -m benchmarks.scanning`).
+    """
+    def __init__(self, parsers):
+        self.keys = []
+        self.branches = []
+        self.regex = None
+
+        candidates = [
+            (key, parser.regex) for key, parser in sorted(parsers.items())
+            if self.can_fuse(parser)
+        ]
+        # One pattern can only have one set of flags; fuse the largest
+        # group of parsers that agree on them.
+        all_flags = [regex.flags for key, regex in candidates]
+        flags = max(all_flags, key=all_flags.count) if all_flags else 0
+
+        fused = []
+        for key, regex in candidates:
+            if regex.flags == flags:
+                self.keys.append(key)
+                fused.append(regex)
+
+        if not fused:
+            return
+
+        # One alternative per parser: the i-th requires parser i to match
+        # here and optionally captures the parsers after it. Every regex
+        # is tried at most once per position, and finditer only stops
+        # where some token starts.
+        alternatives = []
+        group = 1
+        for i, regex in enumerate(fused):
+            alternative = ''
+            branch = []
+            for key, other in zip(self.keys[i:], fused[i:]):
+                capture = '(?=({}))'.format(other.pattern)
+                if other is not regex:
+                    capture = '(?:{}|)'.format(capture)
+                alternative += capture
+                branch.append((key, group))
+                group += 1 + other.groups
+            alternatives.append(alternative)
+            self.branches.append(branch)
+
+        self.regex = re.compile('|'.join(alternatives), flags)
+
+    @staticmethod
+    def can_fuse(parser):
+        cls = type(parser)
+        return (
+            cls.parse == Parser.parse and
+            cls.matches == Parser.matches and
+            parser.regex is not None and
+            not parser.regex.groupindex and
+            parser.regex.groups >= 1
+        )
+
+    @stats.timed('scanner.scan')
+    def scan(self, string):
+        """
+        Returns a dict of fused parser key to its raw matches.
+
+        Matches are the same, and in the same order, as each parser's
+        own `matches` would return.
+        """
+        found = dict((key, []) for key in self.keys)
+        if self.regex is None:
+            return found
+
+        # Emulates finditer per parser: a parser's next match can't start
+        # before its previous one ended.
+        resume = dict((key, 0) for key in self.keys)
+        for m in self.regex.finditer(string):
+            start = m.start()
+            for branch in self.branches:
+                if m.end(branch[0][1]) != -1:
+                    break
+
+            for key, group in branch:
+                if start < resume[key]:
+                    continue
+                end = m.end(group)
+                if end == -1:
+                    continue
+                found[key].append(m.group(group + 1))
+                resume[key] = end
+
+        return found
+
+
+def join(strings):
+    """
+    Returns `strings` joined into one buffer with `SEPARATOR`, and the
+    offset each one starts at in it.
+
+    The strings should all be text, or all bytes, as lines read from
+    stdin are under Python 2; the separator is the same type, so bytes
+    aren't decoded.
+    """
+    separator = SEPARATOR
+    if strings and isinstance(strings[0], bytes):
+        separator = SEPARATOR.encode('ascii')
+    starts = []
+    offset = 0
+    for string in strings:
+        starts.append(offset)
+        offset += len(string) + len(separator)
+    return separator.join(strings), starts
+
+
+# An unescaped `\w`, `\d`, `\s` or `\b`, or their negations.
+UNICODE_CLASS = re.compile(r'(?<!\\)(?:\\\\)*\\[wWdDsSbB]')
+
+
+def byte_regex(regex):
+    """
+    Returns a version of `regex` that matches utf-8 encoded bytes.
+
+    The non-ASCII range used by `LinkParser` is widened to every
+    non-ASCII byte, so multibyte characters match byte by byte. Returns
+    None if the pattern has other non-ASCII characters, or unicode
+    classes such as `\\w`, which only match ASCII in bytes.
+    """
+    pattern = regex.pattern
+    if isinstance(pattern, bytes):
+        return regex
+    if regex.flags & re.UNICODE and UNICODE_CLASS.search(pattern):
+        return None
+
+    pattern = pattern.replace('\u00a1-\uffff', '\\x80-\\xff')
+    try:
+        pattern = pattern.encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    return re.compile(pattern, regex.flags & ~re.UNICODE)
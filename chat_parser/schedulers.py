@@ -0,0 +1,178 @@
+from __future__ import unicode_literals
+
+import heapq
+import itertools
+import re
+import threading
+import time
+from collections import defaultdict
+
+from concurrent.futures import Future
+
+SCHEME = re.compile('[a-zA-Z][a-zA-Z0-9+.-]*://')
+
+
+class FetchScheduler(object):
+    """
+    Fetches urls on a pool of `max_workers` threads, with at most
+    `max_per_host` fetching from any one host at once.
+
+    Submitting a url that's already queued or being fetched returns the
+    future of that fetch, so concurrent callers share it. Queued fetches
+    run earliest deadline first, passing over hosts that are at their
+    limit, so one popular host can't hold up the others. Fetches
+    submitted without a deadline are due `default_wait` seconds later.
+    """
+    def __init__(self, max_workers=4, max_per_host=2, default_wait=4):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.default_wait = default_wait
+
+        self.condition = threading.Condition()
+        # url to its Job, from submit until it's done.
+        self.jobs = {}
+        # host to a heap of [deadline, sequence, job] for its queued jobs.
+        # Promoted jobs leave their old entry behind with job set to None.
+        self.queues = defaultdict(list)
+        self.running = defaultdict(int)
+        self.sequence = itertools.count()
+        self.threads = []
+        self.idle = 0
+        self.stopped = False
+
+    def submit(self, url, fn, deadline=None):
+        """
+        Returns a future for `fn(url)`, called on one of the pool's
+        threads.
+
+        `deadline` is when the caller wants the result by, in
+        `time.time()` seconds.
+        """
+        if deadline is None:
+            deadline = time.time() + self.default_wait
+
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("Can't submit fetches after shutdown.")
+
+            job = self.jobs.get(url)
+            # A finished job stays in `jobs` until its worker is done
+            # with it; fetch again rather than return its old result.
+            if job is not None and not job.future.done():
+                if job.entry is not None and deadline < job.entry[0]:
+                    job.entry[2] = None
+                    self.enqueue(job, deadline)
+                return job.future
+
+            job = self.jobs[url] = Job(url, fn)
+            self.enqueue(job, deadline)
+            if self.idle:
+                self.wake()
+            elif len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            return job.future
+
+    def enqueue(self, job, deadline):
+        job.entry = [deadline, next(self.sequence), job]
+        heapq.heappush(self.queues[job.host], job.entry)
+
+    def wake(self):
+        # Counted off here rather than by the woken thread, so another
+        # submit before it runs wakes a different one.
+        self.idle -= 1
+        self.condition.notify()
+
+    def next_job(self):
+        """
+        Takes the queued job with the earliest deadline from a host that
+        has room for it, or returns None.
+        """
+        best = None
+        for host, queue in list(self.queues.items()):
+            while queue and queue[0][2] is None:
+                heapq.heappop(queue)
+            if not queue:
+                del self.queues[host]
+            elif self.running.get(host, 0) < self.max_per_host:
+                if best is None or queue[0] < best[1][0]:
+                    best = (host, queue)
+
+        if best is None:
+            return None
+        host, queue = best
+        job = heapq.heappop(queue)[2]
+        job.entry = None
+        return job
+
+    def work(self):
+        while True:
+            with self.condition:
+                while True:
+                    job = self.next_job()
+                    if job is not None:
+                        break
+                    if self.stopped and not self.queues:
+                        return
+                    self.idle += 1
+                    self.condition.wait()
+                self.running[job.host] += 1
+
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        result = job.fn(job.url)
+                    except BaseException as e:
+                        job.future.set_exception(e)
+                    else:
+                        job.future.set_result(result)
+            finally:
+                with self.condition:
+                    self.running[job.host] -= 1
+                    if not self.running[job.host]:
+                        del self.running[job.host]
+                    if self.jobs.get(job.url) is job:
+                        del self.jobs[job.url]
+                    # A job this one was holding back may be runnable now.
+                    if self.idle:
+                        self.wake()
+
+    def shutdown(self, wait=True):
+        """Stops the pool once every queued fetch has run."""
+        with self.condition:
+            self.stopped = True
+            self.idle = 0
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+class Job(object):
+    def __init__(self, url, fn):
+        self.url = url
+        self.fn = fn
+        self.host = url_host(url)
+        self.future = Future()
+        # This job's entry in its host's queue while it's queued.
+        self.entry = None
+
+
+def url_host(url):
+    """
+    Returns the host, and port if it has one, that `url` points at.
+
+    The authority is split out by hand: `urlparse` raises on some links
+    the tokenizer matches, like `[@a.com`.
+    """
+    scheme = SCHEME.match(url)
+    if scheme:
+        url = url[scheme.end():]
+    end = len(url)
+    for delimiter in '/?#':
+        index = url.find(delimiter, 0, end)
+        if index != -1:
+            end = index
+    return url[:end].rpartition('@')[2].lower()
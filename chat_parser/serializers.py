@@ -1,6 +1,238 @@
 import json
+import numbers
+import struct
 
+from . import stats
+from .results import Result
 
-class JSONSerializer(object):
+string_types = (bytes, type(u''))
+
+
+class Serializer(object):
+    """
+    Turns parsed data into a string.
+
+    `dump` writes one record to a file object, followed by `terminator`
+    so records can be read back one at a time.
+    """
+    terminator = '\n'
+
+    def serialize(self, data):
+        raise NotImplementedError()
+
+    def dump(self, data, f):
+        f.write(self.serialize(data))
+        f.write(self.terminator)
+
+
+class JSONSerializer(Serializer):
+    @stats.timed('serializer.{}')
+    def serialize(self, data):
+        return json.dumps(data, indent=2, default=to_data)
+
+
+class CompactJSONSerializer(Serializer):
+    """JSON without any whitespace."""
+    @stats.timed('serializer.{}')
+    def serialize(self, data):
+        return json.dumps(data, separators=(',', ':'), default=to_data)
+
+
+class NDJSONSerializer(CompactJSONSerializer):
+    """
+    Compact JSON on a single line, for newline delimited output.
+
+    `dump` writes each record to the file as soon as it's encoded, so a
+    stream of them is never held in memory. (`json.dump` would skip the
+    record's string too, but its chunked encoder is about three times
+    slower.)
+    """
+
+
+class BinarySerializer(Serializer):
+    """
+    A compact binary encoding, for passing results between services.
+
+    Each record is framed by its length as a varint, so a stream of them
+    can be split without scanning for delimiters. Values are tagged:
+
+        None, False, True   one tag byte each
+        int                 tag, zigzag varint
+        float               tag, 8 byte big-endian double
+        str                 tag, varint length, utf-8 bytes
+        list                tag, varint length, values
+        dict                tag, varint length, (varint length, utf-8
+                            key bytes, value) pairs
+
+    `deserialize` reads a record back, and `read_records` a stream of
+    them.
+    """
+    terminator = b''
+
+    NONE, FALSE, TRUE, INT, FLOAT, STR, LIST, DICT = range(8)
+
+    @stats.timed('serializer.{}')
     def serialize(self, data):
-        return json.dumps(data, indent=2)
+        body = bytearray()
+        self.encode(data, body)
+        frame = bytearray()
+        write_varint(len(body), frame)
+        frame += body
+        return bytes(frame)
+
+    def encode(self, value, out):
+        if value is None:
+            out.append(self.NONE)
+        elif value is True:
+            out.append(self.TRUE)
+        elif value is False:
+            out.append(self.FALSE)
+        elif isinstance(value, string_types):
+            out.append(self.STR)
+            write_string(value, out)
+        elif isinstance(value, (list, tuple)):
+            out.append(self.LIST)
+            write_varint(len(value), out)
+            for item in value:
+                self.encode(item, out)
+        elif isinstance(value, dict):
+            out.append(self.DICT)
+            write_varint(len(value), out)
+            for key, item in value.items():
+                write_string(key, out)
+                self.encode(item, out)
+        elif isinstance(value, float):
+            out.append(self.FLOAT)
+            out += struct.pack('>d', value)
+        elif isinstance(value, numbers.Integral):
+            out.append(self.INT)
+            write_varint(value << 1 if value >= 0 else (-value << 1) - 1, out)
+        elif isinstance(value, Result):
+            self.encode(value.to_dict(), out)
+        else:
+            raise TypeError("Can't serialize {!r}".format(value))
+
+    def deserialize(self, frame):
+        """Returns the data of one serialized record."""
+        frame = bytearray(frame)
+        length, pos = read_varint(frame, 0)
+        if len(frame) - pos != length:
+            raise ValueError("Frame is {} bytes, expected {}".format(
+                len(frame) - pos, length))
+        value, pos = self.decode(frame, pos)
+        return value
+
+    def decode(self, buf, pos):
+        tag = buf[pos]
+        pos += 1
+        if tag == self.NONE:
+            return None, pos
+        elif tag == self.FALSE:
+            return False, pos
+        elif tag == self.TRUE:
+            return True, pos
+        elif tag == self.STR:
+            return read_string(buf, pos)
+        elif tag == self.LIST:
+            length, pos = read_varint(buf, pos)
+            items = []
+            for i in range(length):
+                item, pos = self.decode(buf, pos)
+                items.append(item)
+            return items, pos
+        elif tag == self.DICT:
+            length, pos = read_varint(buf, pos)
+            items = {}
+            for i in range(length):
+                key, pos = read_string(buf, pos)
+                items[key], pos = self.decode(buf, pos)
+            return items, pos
+        elif tag == self.FLOAT:
+            value = struct.unpack('>d', bytes(buf[pos:pos + 8]))[0]
+            return value, pos + 8
+        elif tag == self.INT:
+            n, pos = read_varint(buf, pos)
+            return (n >> 1 if not n & 1 else -((n + 1) >> 1)), pos
+        raise ValueError("Unknown tag {} at byte {}".format(tag, pos - 1))
+
+    def read_records(self, f):
+        """Yields the data of each record in the binary file object `f`."""
+        while True:
+            length = 0
+            shift = 0
+            while True:
+                byte = f.read(1)
+                if not byte:
+                    if shift:
+                        raise ValueError("Truncated frame length")
+                    return
+                byte = ord(byte)
+                length |= (byte & 0x7f) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            body = f.read(length)
+            if len(body) != length:
+                raise ValueError("Truncated frame")
+            value, pos = self.decode(bytearray(body), 0)
+            yield value
+
+
+def to_data(value):
+    """
+    Converts values `json` can't encode, as its `default`: `Result`s
+    become the dicts they stand for.
+    """
+    if isinstance(value, Result):
+        return value.to_dict()
+    raise TypeError("Can't serialize {!r}".format(value))
+
+
+def write_varint(n, out):
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(buf, pos):
+    n = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+
+def write_string(value, out):
+    # Bytestrings are taken to be utf-8 already.
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    write_varint(len(value), out)
+    out += value
+
+
+def read_string(buf, pos):
+    length, pos = read_varint(buf, pos)
+    end = pos + length
+    return bytes(buf[pos:end]).decode('utf-8'), end
+
+
+serializer_classes = {
+    'json': JSONSerializer,
+    'compact': CompactJSONSerializer,
+    'ndjson': NDJSONSerializer,
+    'binary': BinarySerializer,
+}
+
+
+def get_serializer_class(format):
+    """Returns the serializer class registered for `format`."""
+    try:
+        return serializer_classes[format]
+    except KeyError:
+        raise ValueError("Unknown format: {!r}. Use one of: {}".format(
+            format, ', '.join(sorted(serializer_classes))))
@@ -0,0 +1,274 @@
+"""
+A long-running HTTP server for parsing messages.
+
+The server keeps one handler for its whole life, so the fetch
+scheduler's threads, pooled connections and the title cache stay warm
+between requests rather than being rebuilt by every `chatparse` run.
+
+    POST /parse   the body is one message; answers with its result.
+    POST /batch   the body is messages, one per line; answers with one
+                  record per message, in order. Each distinct link in
+                  the batch is fetched once.
+
+Both take `format` (as `--format`, defaulting to `compact` for /parse
+and `ndjson` for /batch), `timeout` in seconds, and `titles=0` to skip
+fetching titles, as query parameters.
+
+At most `workers` requests are parsed at once and `queue_size` more
+wait their turn. Requests beyond that are answered straight away with
+503 and a Retry-After header, so callers back off rather than pile up.
+Their bodies aren't read, so at most `workers + queue_size` are ever
+held in memory; the connection is closed instead.
+"""
+import logging
+import os
+import socket
+import sys
+import threading
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import TCPServer, ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import TCPServer, ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+from . import caches, parsers
+from .handlers import Handler
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, in bytes.
+MAX_BODY = 16 * 1024 * 1024
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'compact': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'binary': 'application/octet-stream',
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+class ParseRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests.
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write; small unbuffered writes stall on
+    # delayed ACKs once the connection is reused.
+    wbufsize = -1
+
+    def do_POST(self):
+        try:
+            url = urlparse(self.path)
+            if url.path == '/parse':
+                default_format, batch = 'compact', False
+            elif url.path == '/batch':
+                default_format, batch = 'ndjson', True
+            else:
+                raise RequestError(404, "No such endpoint: {}".format(
+                    url.path))
+            params = dict(
+                (key, values[-1])
+                for key, values in parse_qs(url.query).items())
+
+            if not self.server.admit():
+                # The body is left unread, so the connection can't be
+                # reused.
+                self.close_connection = True
+                self.send_body(503, b'Too many requests queued.\n',
+                               'text/plain',
+                               [('Retry-After', '1'), ('Connection', 'close')])
+                return
+            try:
+                body = self.read_body()
+                self.server.start()
+                try:
+                    content, content_type = self.parse(
+                        body, batch, params, default_format)
+                finally:
+                    self.server.finish()
+            finally:
+                self.server.leave()
+        except RequestError as e:
+            headers = []
+            if self.close_connection:
+                headers.append(('Connection', 'close'))
+            self.send_body(e.status, (str(e) + '\n').encode('utf-8'),
+                           'text/plain', headers)
+            return
+        except Exception:
+            logger.exception("Error parsing a request to %s.", self.path)
+            self.send_body(500, b'Error parsing the request.\n',
+                           'text/plain')
+            return
+
+        self.send_body(200, content, content_type)
+
+    def read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            self.close_connection = True
+            raise RequestError(411, "Content-Length is required.")
+        if length > MAX_BODY:
+            self.close_connection = True
+            raise RequestError(413, "Bodies are limited to {} bytes.".format(
+                MAX_BODY))
+        try:
+            return self.rfile.read(length).decode('utf-8')
+        except UnicodeDecodeError:
+            raise RequestError(400, "The body must be utf-8.")
+
+    def parse(self, body, batch, params, default_format):
+        """Returns the serialized result of the request, and its type."""
+        format = params.get('format', default_format)
+        handler = self.server.handlers[params.get('titles') != '0']
+        try:
+            serializer = handler.serializer(format)
+            timeout = params.get('timeout') and float(params['timeout'])
+        except ValueError as e:
+            raise RequestError(400, str(e))
+
+        if batch:
+            results = handler.parse_many(lines(body), timeout=timeout)
+        else:
+            results = [handler.parse(body, timeout)]
+
+        chunks = []
+        for data in results:
+            chunks.append(encode(serializer.serialize(data)))
+            if batch:
+                chunks.append(encode(serializer.terminator))
+        return b''.join(chunks), CONTENT_TYPES.get(format, 'text/plain')
+
+    def send_body(self, status, content, content_type, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class ParseServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves `ParseRequestHandler` on a TCP address.
+
+    `workers` requests are parsed at once, and `queue_size` more wait
+    for a turn.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=8, queue_size=64, memoize=False,
+                 request_handler=ParseRequestHandler):
+        HTTPServer.__init__(self, address, request_handler)
+        # Keyed by whether they fetch titles. Their results differ, so
+        # each has its own memo.
+        self.handlers = dict(
+            (titles, Handler(
+                titles=titles, memo=caches.ParseCache() if memoize else None))
+            for titles in (True, False))
+        self.running = threading.Semaphore(workers)
+        self.admitted = threading.Semaphore(workers + queue_size)
+        # Requests waiting for a worker.
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """
+        Takes a place in the queue, or returns False straight away if
+        it's full. Every admitted request must `leave`.
+        """
+        return self.admitted.acquire(False)
+
+    def start(self):
+        """Waits for a worker; `finish` gives it back."""
+        with self.lock:
+            self.waiting += 1
+        self.running.acquire()
+        with self.lock:
+            self.waiting -= 1
+
+    def finish(self):
+        self.running.release()
+
+    def leave(self):
+        self.admitted.release()
+
+    def handle_error(self, request, client_address):
+        # Clients that hang up mid-response aren't the server's problem.
+        logger.debug("Error answering a request.", exc_info=True)
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+
+class UnixParseServer(ParseServer):
+    """Serves `ParseRequestHandler` on a Unix socket at `path`."""
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        ParseServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def serve(host='127.0.0.1', port=8080, path=None, workers=8, queue_size=64,
+          memoize=False):
+    """
+    Serves requests until interrupted, on a Unix socket at `path` if
+    given or on `host` and `port`.
+    """
+    if path:
+        server = UnixParseServer(path, workers, queue_size, memoize)
+        sys.stderr.write("Serving on {}\n".format(path))
+    else:
+        server = ParseServer((host, port), workers, queue_size, memoize)
+        sys.stderr.write("Serving on {}\n".format(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        parsers.shutdown()
+
+
+def lines(body):
+    """
+    Splits a /batch body into messages as `chatparse --lines` reads
+    them: at newlines only, not at every line boundary `splitlines`
+    knows.
+    """
+    messages = body.split('\n')
+    if not messages[-1]:
+        messages.pop()
+    return messages
+
+
+def encode(content):
+    if isinstance(content, bytes):
+        return content
+    return content.encode('utf-8')
@@ -0,0 +1,169 @@
+"""
+Instrumentation hooks.
+
+Timers are called as `timer(stage, seconds, tags)` after each timed
+stage, and counters as `counter(name, value, tags)`. `tags` is a dict,
+e.g. `{'host': 'example.com'}` for fetches. With nothing registered the
+instrumented code skips timing altogether.
+
+Stages:
+    handler.parse, handler.scan, handler.resolve
+    scanner.scan                `scanners.Scanner`'s fused regex pass
+    parser.<Parser class>       Parser.parse
+    fetch.connect               DNS, connect and waiting for headers
+    fetch.read                  reading the body and parsing the title
+    fetch_title                 the whole fetch
+    serializer.<Serializer class>
+
+Counters:
+    fetch.timeouts, fetch.errors, fetch.parse_errors, fetch.skipped
+    fetch.bytes                 bytes read from pages
+    links.budget_exceeded       messages cut short by LinkParser.scan_budget
+    links.pending               titles not fetched by a message's deadline
+    parse_cache.hits, parse_cache.misses
+                                `Handler.parse` results found in, or
+                                missing from, its memo
+"""
+from __future__ import division
+
+import bisect
+import functools
+import threading
+import time
+from collections import defaultdict
+
+timers = []
+counters = []
+
+
+def add_timer(timer):
+    timers.append(timer)
+
+
+def remove_timer(timer):
+    timers.remove(timer)
+
+
+def add_counter(counter):
+    counters.append(counter)
+
+
+def remove_counter(counter):
+    counters.remove(counter)
+
+
+def timing(stage, seconds, **tags):
+    for timer in timers:
+        timer(stage, seconds, tags)
+
+
+def count(name, value=1, **tags):
+    for counter in counters:
+        counter(name, value, tags)
+
+
+def timed(stage):
+    """
+    Decorates a function or method to time it as `stage`.
+
+    A `stage` containing '{}' is formatted with the class name of the
+    method's instance.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timers:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                name = stage
+                if '{}' in stage:
+                    name = stage.format(type(args[0]).__name__)
+                timing(name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+class Histogram(object):
+    """
+    Counts latencies in exponential buckets, from 0.1ms to about 100s.
+    """
+    bounds = [0.0001 * 2 ** i for i in range(21)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """
+        The upper bound of the bucket holding the `p`th percentile, or the
+        maximum if that's lower.
+        """
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= self.count * p and i < len(self.bounds):
+                return min(self.bounds[i], self.max)
+        return self.max
+
+
+class Recorder(object):
+    """
+    Collects latency histograms per stage and per host, and counter
+    totals, from the hooks.
+    """
+    def __init__(self):
+        self.stages = defaultdict(Histogram)
+        self.hosts = defaultdict(Histogram)
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def install(self):
+        add_timer(self.timer)
+        add_counter(self.counter)
+
+    def uninstall(self):
+        remove_timer(self.timer)
+        remove_counter(self.counter)
+
+    def timer(self, stage, seconds, tags):
+        with self.lock:
+            self.stages[stage].add(seconds)
+            if 'host' in tags:
+                self.hosts[(stage, tags['host'])].add(seconds)
+
+    def counter(self, name, value, tags):
+        with self.lock:
+            self.counts[name] += value
+
+    def report(self):
+        lines = ['{:<32} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+            'stage', 'count', 'mean ms', 'p50 ms', 'p99 ms', 'max ms')]
+        with self.lock:
+            rows = sorted(self.stages.items())
+            rows += sorted(
+                ('{} {}'.format(stage, host), histogram)
+                for (stage, host), histogram in self.hosts.items())
+            for name, histogram in rows:
+                lines.append(
+                    '{:<32} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                        name, histogram.count,
+                        histogram.total / histogram.count * 1000,
+                        histogram.percentile(0.5) * 1000,
+                        histogram.percentile(0.99) * 1000,
+                        histogram.max * 1000))
+            if self.counts:
+                lines.append('')
+                for name, value in sorted(self.counts.items()):
+                    lines.append('{:<32} {:>8}'.format(name, value))
+        return '\n'.join(lines)
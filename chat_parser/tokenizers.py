@@ -0,0 +1,212 @@
+"""
+A linear time tokenizer for the links matched by `LinkParser.regex`.
+
+The regex's nested quantifiers backtrack over every way of splitting a
+long run of letters or digits into labels, which takes quadratic time in
+the length of the run. This module finds the same links, in the same
+order, by walking the structure of the regex by hand:
+
+    (?:\\s|^)(scheme? auth? (ipv4 | labels.tld) port? resource?)
+
+A link never contains whitespace, so it's always a prefix of a
+whitespace-delimited word that contains a dot. Each part is matched
+with a regex of a single character class, or of bounded length, so no
+character is looked at more than a few times.
+
+Whitespace and digits are ASCII only, as they are for `LinkParser.regex`
+under Python 2.
+"""
+from __future__ import unicode_literals
+
+import logging
+import re
+import time
+
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+ASCII = getattr(re, 'ASCII', 0)
+
+
+class Syntax(object):
+    """
+    The regexes and literals the tokenizer matches, for text or, with
+    `encoded`, for utf-8 bytes.
+
+    The bytes version widens the non-ASCII range to every non-ASCII byte,
+    so multibyte characters match byte by byte, as `scanners.byte_regex`
+    does for fused regexes, and counts them as one character.
+    """
+    def __init__(self, encoded=False):
+        def compile(pattern, flags=0):
+            if encoded:
+                pattern = pattern.replace(
+                    '\u00a1-\uffff', r'\x80-\xff').encode('ascii')
+            return re.compile(pattern, flags | ASCII)
+
+        def literal(string):
+            return string.encode('ascii') if encoded else string
+
+        # Words containing a dot. The lookbehind only lets a match start
+        # at the beginning of a word, so a long word is scanned once.
+        self.words = compile(r'(?<!\S)[^\s.]*\.\S*')
+        self.scheme = compile(r'(?:https?|s?ftp)://', re.IGNORECASE)
+        self.ipv4 = compile(
+            r'(?:25[0-5]|2[0-4]\d|[0-1]?\d?\d)'
+            r'(?:\.(?:25[0-5]|2[0-4]\d|[0-1]?\d?\d)){3}')
+        # Label characters and hyphens, and top level domain characters.
+        # Cased explicitly: IGNORECASE makes these slow to compile.
+        self.label = compile('[a-zA-Z\u00a1-\uffff0-9-]*')
+        self.tld = compile('[a-zA-Z\u00a1-\uffff]*')
+        self.digits = compile(r'\d*')
+        self.at = literal('@')
+        self.dot = literal('.')
+        self.colon = literal(':')
+        self.slash = literal('/')
+        self.hyphen = literal('-')
+        self.hyphens = literal('--')
+        # Bytes that continue a multibyte character, which aren't counted
+        # in the length of a top level domain.
+        self.continuation = encoded and compile(r'[\x80-\xbf]')
+
+    def length(self, string, start, end):
+        """Returns the number of characters in `string[start:end]`."""
+        if not self.continuation:
+            return end - start
+        return end - start - len(
+            self.continuation.findall(string, start, end))
+
+
+TEXT = Syntax()
+BYTES = Syntax(encoded=True)
+
+
+def find_urls(string, budget=None):
+    """
+    Returns the links in `string`, as `LinkParser.regex` would find them.
+
+    With a `budget` in seconds, gives up once it's spent and returns the
+    links found so far. Byte strings, such as lines read from stdin under
+    Python 2, are taken to be utf-8.
+    """
+    syntax = syntax_of(string)
+    urls = []
+    deadline = budget is not None and time.time() + budget
+    for word in syntax.words.finditer(string):
+        if deadline and time.time() > deadline:
+            logger.warning("Gave up looking for links after {}s in a {} "
+                           "character message.".format(budget, len(string)))
+            stats.count('links.budget_exceeded')
+            break
+        url = match_word(string, word.start(), word.end(), syntax)
+        if url is not None:
+            urls.append(url)
+    return urls
+
+
+def find_url_starts(string, pos=0, endpos=None, syntax=None):
+    """
+    Returns `(start, url)` for each link in `string[pos:endpos]`, in
+    order.
+
+    With `syntax=BYTES`, `string` may be any buffer of utf-8 with `find`,
+    `rfind` and slicing, such as an mmap, and the links are bytes.
+    """
+    if syntax is None:
+        syntax = syntax_of(string)
+    if endpos is None:
+        endpos = len(string)
+    urls = []
+    for word in syntax.words.finditer(string, pos, endpos):
+        start = word.start()
+        url = match_word(string, start, word.end(), syntax)
+        if url is not None:
+            urls.append((start, url))
+    return urls
+
+
+def syntax_of(string):
+    """Returns the syntax that matches `string`: `BYTES` for utf-8."""
+    return BYTES if isinstance(string, bytes) else TEXT
+
+
+def match_word(string, start, end, syntax=TEXT):
+    """
+    Returns the link at the start of the word `string[start:end]`, or
+    None.
+
+    Alternatives are tried in the order the regex tries them; the first
+    to match a host wins.
+    """
+    hosts = {}
+
+    def host(position):
+        if position not in hosts:
+            hosts[position] = match_host(string, position, end, syntax)
+        return hosts[position]
+
+    scheme = syntax.scheme.match(string, start, end)
+    for auth_start in ([scheme.end()] if scheme else []) + [start]:
+        # `\S+(?::\S*)?@` backtracks from the last @ in the word to the
+        # first.
+        at = string.rfind(syntax.at, auth_start + 1, end)
+        while at != -1:
+            host_end = host(at + 1)
+            if host_end is not None:
+                return string[start:match_tail(string, host_end, end, syntax)]
+            at = string.rfind(syntax.at, auth_start + 1, at)
+
+        host_end = host(auth_start)
+        if host_end is not None:
+            return string[start:match_tail(string, host_end, end, syntax)]
+    return None
+
+
+def match_host(string, start, end, syntax=TEXT):
+    """Returns the end of the ipv4 address or domain at `start`, or None."""
+    ipv4 = syntax.ipv4.match(string, start, end)
+    if ipv4:
+        return ipv4.end()
+
+    # Labels can't contain dots, so each one is a whole run of label
+    # characters between dots. Collect the dots after valid labels.
+    dots = []
+    label_start = start
+    while True:
+        label_end = syntax.label.match(string, label_start, end).end()
+        if (label_end == end or
+                string[label_end:label_end + 1] != syntax.dot or
+                not is_label(string, label_start, label_end, syntax)):
+            break
+        dots.append(label_end)
+        label_start = label_end + 1
+
+    # The labels are greedy: the top level domain is tried after the last
+    # dot first.
+    for dot in reversed(dots):
+        tld_end = syntax.tld.match(string, dot + 1, end).end()
+        if syntax.length(string, dot + 1, tld_end) >= 2:
+            return tld_end
+    return None
+
+
+def is_label(string, start, end, syntax=TEXT):
+    """Whether `string[start:end]` matches `(?:[label]-?)*[label]+`."""
+    return (
+        end > start and
+        string[start:start + 1] != syntax.hyphen and
+        string[end - 1:end] != syntax.hyphen and
+        string.find(syntax.hyphens, start, end) == -1
+    )
+
+
+def match_tail(string, start, end, syntax=TEXT):
+    """Returns the end of the optional port and resource at `start`."""
+    if start < end and string[start:start + 1] == syntax.colon:
+        digits = syntax.digits.match(string, start + 1, end).end() - start - 1
+        if digits >= 2:
+            start += 1 + min(digits, 5)
+    if start < end and string[start:start + 1] == syntax.slash:
+        start = end
+    return start
@@ -20,8 +20,12 @@ setup(
     author="Erick Yellott",
     author_email='erick.yellott@gmail.com',
     url='https://github.com/yellottyellott/chat-parser',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'tests']),
     install_requires=install_requires,
+    extras_require={
+        # chat_parser.aio, Python 3.7+ only.
+        'async': ['aiohttp>=3.0'],
+    },
     entry_points={
         'console_scripts': [
             'chatparse = chat_parser.main:main',
@@ -0,0 +1,25 @@
+import sys
+
+import pytest
+
+from chat_parser import caches, parsers
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    # asyncio and async/await syntax.
+    collect_ignore.append('test_aio.py')
+
+
+@pytest.fixture(autouse=True)
+def title_cache(monkeypatch):
+    """Give every test an empty title cache."""
+    cache = caches.MemoryCache()
+    monkeypatch.setattr(parsers.LinkParser, 'title_cache', cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def scheduler():
+    """Finish fetches a test left running before the next one starts."""
+    yield
+    parsers.shutdown()
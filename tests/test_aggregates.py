@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+from collections import Counter
+
+import mock
+
+from chat_parser.aggregates import (
+    Aggregator, SpaceSaving, aggregate, link_domain)
+
+
+def zipf_stream(count, items=500, seed=0):
+    rand = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(items)]
+    total = sum(weights)
+    stream = []
+    for i in range(count):
+        point = rand.random() * total
+        for rank, weight in enumerate(weights):
+            point -= weight
+            if point <= 0:
+                break
+        stream.append('item{}'.format(rank))
+    return stream
+
+
+def assert_bounds(sketch, stream):
+    """Every count is within its error of the truth."""
+    true = Counter(stream)
+    assert sketch.total == len(stream)
+    assert len(sketch.counters) <= sketch.capacity
+    for item, count, error in sketch.top():
+        assert count - error <= true[item] <= count
+    for item in true:
+        if item not in sketch.counters:
+            assert true[item] <= sketch.minimum()
+    assert sketch.minimum() <= float(len(stream)) / sketch.capacity
+
+
+class TestSpaceSaving(object):
+    def test_exact_under_capacity(self):
+        sketch = SpaceSaving(10)
+        for item in 'abacabad':
+            sketch.add(item)
+        assert sketch.top(2) == [('a', 4, 0), ('b', 2, 0)]
+        assert sketch.minimum() == 0
+
+    def test_bounds(self):
+        stream = zipf_stream(20000)
+        sketch = SpaceSaving(50)
+        for item in stream:
+            sketch.add(item)
+
+        assert_bounds(sketch, stream)
+        top = [item for item, count, error in sketch.top(5)]
+        assert top == ['item0', 'item1', 'item2', 'item3', 'item4']
+
+    def test_merge(self):
+        stream = zipf_stream(20000)
+        sketches = []
+        for shard in range(4):
+            sketch = SpaceSaving(50)
+            for item in stream[shard::4]:
+                sketch.add(item)
+            sketches.append(sketch)
+
+        merged = sketches[0]
+        for sketch in sketches[1:]:
+            merged = merged.merge(sketch)
+
+        assert_bounds(merged, stream)
+        assert merged.top(1)[0][0] == 'item0'
+
+    def test_merge_keeps_missing_bound(self):
+        full = SpaceSaving(2)
+        for item in 'aabbc':
+            full.add(item)
+        merged = full.merge(SpaceSaving(10))
+        assert_bounds(merged, 'aabbc')
+
+    def test_to_dict(self):
+        sketch = SpaceSaving(3)
+        for item in 'abcdab':
+            sketch.add(item)
+        restored = SpaceSaving.from_dict(sketch.to_dict())
+        assert restored.top() == sketch.top()
+        assert restored.minimum() == sketch.minimum()
+        restored.add('e')
+        sketch.add('e')
+        assert restored.top() == sketch.top()
+
+
+class TestAggregator(object):
+    messages = [
+        "@Finn (bmo) http://adventure.com/a",
+        "@finn @jake https://Adventure.com:8080/b lsp.org",
+        "(bmo) (bmo)",
+    ]
+
+    def test_report(self):
+        fetch = mock.Mock()
+        with mock.patch('chat_parser.parsers.fetch_title', fetch):
+            report = Aggregator().add_all(self.messages).report(top=1)
+
+        assert not fetch.called
+        assert report['messages'] == 3
+        assert report['mentions']['top'] == [
+            {'item': 'finn', 'count': 2, 'error': 0}]
+        assert report['emoticons']['top'] == [
+            {'item': 'bmo', 'count': 2, 'error': 0}]
+        assert report['domains']['top'] == [
+            {'item': 'adventure.com', 'count': 2, 'error': 0}]
+        assert report['domains']['total'] == 3
+
+    def test_merge(self):
+        merged = Aggregator().add_all(self.messages[:1])
+        merged.merge(Aggregator.from_dict(
+            Aggregator().add_all(self.messages[1:]).to_dict()))
+        assert merged.report() == Aggregator().add_all(self.messages).report()
+
+    def test_parallel(self):
+        messages = self.messages * 50
+        parallel = aggregate(messages, workers=2, chunk_size=7)
+        assert parallel.report() == aggregate(messages).report()
+
+
+def test_link_domain():
+    assert link_domain('https://user@Example.com:8080/x') == 'example.com'
+    assert link_domain('example.com/x') == 'example.com'
+    assert link_domain('[@a.com') == 'a.com'
+
+
+def test_odd_links():
+    """Links urlparse rejects are counted like any other."""
+    report = aggregate(["see [@a.com now", "a.com"]).report()
+    assert report['domains']['top'] == [
+        {'item': 'a.com', 'count': 2, 'error': 0}]
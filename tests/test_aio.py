@@ -0,0 +1,179 @@
+import asyncio
+import threading
+
+import pytest
+
+from chat_parser.aio import AsyncHandler, aparse
+from chat_parser.handlers import Handler
+
+
+class Requests(object):
+    """What the stub was asked for, and how many requests overlapped."""
+    def __init__(self):
+        self.paths = []
+        self.active = 0
+        self.max_active = 0
+
+    def start(self, path):
+        self.paths.append(path)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+    def finish(self):
+        self.active -= 1
+
+
+# Only touched from the stub's loop, and read once a parse is done.
+requests = Requests()
+
+
+async def handle(reader, writer):
+    """
+    A tiny HTTP server. Paths are:
+        /delay/<seconds>/<title>
+        /gather/<count>/<title>: waits until `count` were open at once
+        /zip/<title>
+        /<title>
+    """
+    request = await reader.readuntil(b'\r\n\r\n')
+    path = request.split(b' ')[1].decode('ascii').strip('/')
+    requests.start(path)
+    try:
+        await respond(writer, path.split('/'))
+    finally:
+        requests.finish()
+
+
+async def respond(writer, path):
+    content_type = 'text/html'
+    if path[0] == 'delay':
+        await asyncio.sleep(float(path[1]))
+        path = path[2:]
+    elif path[0] == 'gather':
+        while requests.max_active < int(path[1]):
+            await asyncio.sleep(0.01)
+        path = path[2:]
+    elif path[0] == 'zip':
+        content_type = 'application/zip'
+        path = path[1:]
+
+    body = '<html><head><title>{}</title></head></html>'.format(
+        '/'.join(path)).encode('utf-8')
+    writer.write(
+        'HTTP/1.1 200 OK\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+        'Connection: close\r\n\r\n'.format(
+            content_type, len(body)).encode('ascii') + body)
+    await writer.drain()
+    writer.close()
+
+
+@pytest.fixture(scope='module')
+def server():
+    """Runs the stub on its own loop so blocking clients can use it too."""
+    loop = asyncio.new_event_loop()
+    stub = loop.run_until_complete(
+        asyncio.start_server(handle, '127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield '127.0.0.1:{}'.format(stub.sockets[0].getsockname()[1])
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+@pytest.fixture
+def seen():
+    global requests
+    requests = Requests()
+    return requests
+
+
+def parse(string, **kwargs):
+    async def run():
+        async with AsyncHandler(**kwargs) as handler:
+            return await handler.parse(string)
+    return asyncio.run(run())
+
+
+class TestAsyncHandler(object):
+    def test_same_as_handler(self, server):
+        strings = [
+            "@jake, http://{}/jake is up. (thumbsup)".format(server),
+            "(finn) http://{0}/finn and http://{0}/zip/iso".format(server),
+            "@bmo {}/delay/0.05/BMO".format(server),
+            "@bmo says nothing",
+            "",
+        ]
+        for string in strings:
+            assert parse(string) == Handler().parse(string)
+
+    def test_titles(self, server):
+        data = parse("http://{0}/finn http://{0}/zip/iso".format(server))
+        assert [link['title'] for link in data['links']] == ['finn', '']
+
+    def test_equivalent_links(self, server, seen):
+        links = [
+            "http://{}/finn".format(server),
+            "HTTP://{}/finn?utm_source=x#top".format(server),
+        ]
+        data = parse(" ".join(links))
+        assert seen.paths == ['finn']
+        assert data['links'] == [
+            {'url': url, 'title': 'finn'} for url in links]
+
+    def test_concurrency(self, server, seen):
+        # Each fetch only gets its title once all four are open at once.
+        string = " ".join(
+            "http://{}/gather/4/finn{}".format(server, i) for i in range(4))
+        data = parse(string, concurrency=4)
+        assert [link['title'] for link in data['links']] == [
+            'finn{}'.format(i) for i in range(4)]
+        assert seen.max_active == 4
+
+        seen.max_active = 0
+        parse(" ".join(
+            "http://{}/delay/0.01/jake{}".format(server, i)
+            for i in range(4)), concurrency=1)
+        assert seen.max_active == 1
+
+    def test_timeout(self, server):
+        string = "http://{}/delay/5/slow".format(server)
+        data = parse(string, timeout=0.1)
+        assert data['links'] == [{'url': string, 'title': ''}]
+
+    def test_cancel(self, server):
+        started = []
+        cancelled = []
+
+        class Handler(AsyncHandler):
+            async def read_title(self, url):
+                started.append(url)
+                try:
+                    return await super(Handler, self).read_title(url)
+                except asyncio.CancelledError:
+                    cancelled.append(url)
+                    raise
+
+        async def run():
+            async with Handler() as handler:
+                task = asyncio.ensure_future(handler.parse(
+                    "http://{}/delay/5/slow".format(server)))
+                while not started:
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                await task
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(run())
+        assert cancelled == started
+
+    def test_aparse(self, server):
+        string = asyncio.run(aparse("@jake http://{}/jake".format(server)))
+        assert '"jake"' in string
@@ -0,0 +1,272 @@
+from __future__ import unicode_literals
+
+import itertools
+import threading
+
+from concurrent.futures import Future
+import mock
+import pytest
+
+from chat_parser import parsers, results
+from chat_parser.caches import MemoryCache, ParseCache, SQLiteCache
+from chat_parser.handlers import Handler
+from chat_parser.results import Result
+
+
+class CacheTests(object):
+    """
+    Behaviour every title cache shares. Subclasses define `make_cache`.
+    """
+    def test_miss(self):
+        cache = self.make_cache()
+        with pytest.raises(KeyError):
+            cache.get("finn.com")
+        assert cache.misses == 1
+
+    def test_hit(self):
+        cache = self.make_cache()
+        cache.set("finn.com", "Finn")
+        assert cache.get("finn.com") == "Finn"
+        assert cache.hits == 1
+
+    def test_ttl(self):
+        cache = self.make_cache(ttl=10)
+        with mock.patch('time.time', lambda: 100):
+            cache.set("finn.com", "Finn")
+        with mock.patch('time.time', lambda: 109):
+            assert cache.get("finn.com") == "Finn"
+        with mock.patch('time.time', lambda: 110):
+            with pytest.raises(KeyError):
+                cache.get("finn.com")
+
+    def test_negative_ttl(self):
+        """Empty titles expire sooner."""
+        cache = self.make_cache(ttl=10, negative_ttl=2)
+        with mock.patch('time.time', lambda: 100):
+            cache.set("finn.com", "")
+        with mock.patch('time.time', lambda: 101):
+            assert cache.get("finn.com") == ""
+        with mock.patch('time.time', lambda: 102):
+            with pytest.raises(KeyError):
+                cache.get("finn.com")
+
+    def test_expires(self):
+        cache = self.make_cache(ttl=10)
+        with mock.patch('time.time', lambda: 100):
+            cache.set("finn.com", "Finn")
+            assert cache.expires("finn.com") == 110
+            with pytest.raises(KeyError):
+                cache.expires("jake.com")
+        assert cache.hits == cache.misses == 0
+
+    def test_lru_eviction(self):
+        cache = self.make_cache(max_size=2)
+        clock = itertools.count(100)
+        with mock.patch('time.time', lambda: next(clock)):
+            cache.set("finn.com", "Finn")
+            cache.set("jake.com", "Jake")
+            cache.get("finn.com")
+            cache.set("bmo.com", "BMO")
+
+            assert cache.get("finn.com") == "Finn"
+            assert cache.get("bmo.com") == "BMO"
+            with pytest.raises(KeyError):
+                cache.get("jake.com")
+        assert cache.evictions == 1
+
+    def test_stats(self):
+        cache = self.make_cache()
+        cache.set("finn.com", "Finn")
+        cache.get("finn.com")
+        with pytest.raises(KeyError):
+            cache.get("jake.com")
+        assert cache.stats() == {
+            'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1}
+
+
+class TestMemoryCache(CacheTests):
+    def make_cache(self, **kwargs):
+        return MemoryCache(**kwargs)
+
+
+class TestSQLiteCache(CacheTests):
+    @pytest.fixture(autouse=True)
+    def path(self, tmpdir):
+        self.path = str(tmpdir.join('titles.db'))
+
+    def make_cache(self, **kwargs):
+        return SQLiteCache(self.path, **kwargs)
+
+    def test_shared_between_instances(self):
+        self.make_cache().set("finn.com", "Finn")
+        assert self.make_cache().get("finn.com") == "Finn"
+
+
+DATA = {
+    'mentions': ['finn'],
+    'links': [{'url': 'finn.com', 'title': 'Finn'}],
+}
+
+
+def key(string):
+    return ParseCache.key(string)
+
+
+class TestParseCache(object):
+    def test_does_not_intern(self):
+        """Memoized strings go with their entries, not the intern table."""
+        cache = ParseCache()
+        cache.set(key("@unique_finn"), {'mentions': ['unique_finn']})
+        assert 'unique_finn' not in results._strings
+
+    def test_miss(self):
+        cache = ParseCache()
+        with pytest.raises(KeyError):
+            cache.get(key("@finn finn.com"))
+        assert cache.stats()['misses'] == 1
+
+    def test_hit(self):
+        cache = ParseCache()
+        cache.set(key("@finn finn.com"), DATA)
+        assert cache.get(key("@finn finn.com")) == DATA
+        compact = cache.get(key("@finn finn.com"), compact=True)
+        assert isinstance(compact, Result)
+        assert compact == DATA
+
+    def test_hits_are_copies(self):
+        cache = ParseCache()
+        data = {'mentions': ['finn'], 'links': [{'url': 'a.com', 'title': 'A'}]}
+        cache.set(key("message"), data)
+        data['mentions'].append('jake')
+
+        first = cache.get(key("message"))
+        first['mentions'].append('bmo')
+        first['links'][0]['title'] = 'Changed'
+        cache.get(key("message"), compact=True).mentions = ('changed',)
+
+        assert cache.get(key("message")) == {
+            'mentions': ['finn'], 'links': [{'url': 'a.com', 'title': 'A'}]}
+
+    def test_ttl(self):
+        cache = ParseCache()
+        with mock.patch('time.time', lambda: 100):
+            cache.set(key("message"), DATA, ttl=10)
+            cache.set(key("forever"), DATA)
+        with mock.patch('time.time', lambda: 110):
+            with pytest.raises(KeyError):
+                cache.get(key("message"))
+            assert cache.get(key("forever")) == DATA
+        assert len(cache) == 1
+
+    def test_byte_limit(self):
+        cache = ParseCache(max_bytes=10000)
+        for i in range(100):
+            cache.set(key("message {}".format(i)),
+                      {'mentions': ['user{}'.format(i)]})
+        stats = cache.stats()
+        assert 0 < stats['bytes'] <= 10000
+        assert stats['evictions'] == 100 - stats['size']
+        assert cache.get(key("message 99")) == {'mentions': ['user99']}
+        with pytest.raises(KeyError):
+            cache.get(key("message 0"))
+
+    def test_hit_rate(self):
+        cache = ParseCache()
+        cache.set(key("message"), DATA)
+        cache.get(key("message"))
+        with pytest.raises(KeyError):
+            cache.get(key("other"))
+        assert cache.stats()['hit_rate'] == 0.5
+
+    def test_threads(self):
+        cache = ParseCache(max_bytes=20000)
+
+        def work(n):
+            for i in range(500):
+                message = "message {}".format(i % 50)
+                try:
+                    assert cache.get(key(message)) == {'mentions': [message]}
+                except KeyError:
+                    cache.set(key(message), {'mentions': [message]})
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        assert stats['hits'] + stats['misses'] == 2000
+        assert stats['bytes'] <= 20000
+
+
+class TestMemoizedHandler(object):
+    string = "@finn finn.com (bmo)"
+
+    def test_parses_once(self):
+        fetch = mock.Mock(return_value='Finn')
+        handler = Handler(memo=ParseCache())
+        with mock.patch.object(handler, 'scan', wraps=handler.scan) as scan:
+            with mock.patch('chat_parser.parsers.fetch_title', fetch):
+                first = handler.parse(self.string)
+                second = handler.parse(self.string)
+
+        assert first == second
+        assert first is not second
+        assert scan.call_count == 1
+        assert handler.memo.stats()['hits'] == 1
+
+    def test_expires_with_titles(self, title_cache):
+        title_cache.ttl = 50
+        title_cache.negative_ttl = 5
+        handler = Handler(memo=ParseCache())
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: ''):
+            with mock.patch('time.time', lambda: 100):
+                handler.parse(self.string)
+
+        entries = list(handler.memo.entries.values())
+        assert [expires for result, size, expires in entries] == [105]
+
+    def test_expires_with_cached_titles(self, title_cache):
+        """A title cached earlier bounds the memo by when it expires."""
+        title_cache.ttl = 50
+        handler = Handler(memo=ParseCache())
+        with mock.patch('time.time', lambda: 0):
+            title_cache.set('http://finn.com', 'Finn')
+        with mock.patch('time.time', lambda: 49):
+            handler.parse(self.string)
+
+        entries = list(handler.memo.entries.values())
+        assert entries[0][2] == 50
+
+    def test_uncached_titles_are_not_cached(self, title_cache):
+        """Titles evicted from the title cache can't bound the memo."""
+        handler = Handler(memo=ParseCache())
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: 'Finn'):
+            with mock.patch.object(title_cache, 'expires',
+                                   side_effect=KeyError):
+                handler.parse(self.string)
+        assert len(handler.memo) == 0
+
+    def test_unfetched_titles_are_not_cached(self):
+        handler = Handler(memo=ParseCache())
+        with mock.patch.object(parsers.LinkParser, 'fetch_titles',
+                               lambda self, urls, deadline=None: [Future()]):
+            data = handler.parse(self.string, timeout=0)
+
+        assert data['links'] == [{'url': 'finn.com', 'title': None}]
+        assert len(handler.memo) == 0
+
+    def test_without_title_cache(self, monkeypatch):
+        monkeypatch.setattr(parsers.LinkParser, 'title_cache', None)
+        handler = Handler(memo=ParseCache())
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: 'Finn'):
+            handler.parse(self.string)
+            handler.parse("(bmo)")
+        assert len(handler.memo) == 1
+
+    def test_without_titles(self):
+        handler = Handler(titles=False, compact=True, memo=ParseCache())
+        first = handler.parse(self.string)
+        second = handler.parse(self.string)
+        assert isinstance(second, Result)
+        assert first == second
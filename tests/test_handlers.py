@@ -1,9 +1,38 @@
+# -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import contextlib
 import mock
 import json
+import random
+import subprocess
+import sys
+import threading
+import time
 
-from chat_parser.handlers import Handler, parse
+import pytest
+
+from chat_parser import parsers
+from chat_parser.handlers import (
+    Handler, parse, parse_many, parse_parallel)
+
+from .test_parsers import mock_page, patch_get
+from .test_scanners import STRINGS
+
+
+@contextlib.contextmanager
+def recording_batches():
+    """Collects every batch of `LinkParser` made while active."""
+    batches = []
+    batch = parsers.LinkParser.batch
+
+    def record(self):
+        parser = batch(self)
+        batches.append(parser)
+        return parser
+
+    with mock.patch.object(parsers.LinkParser, 'batch', record):
+        yield batches
 
 
 class TestHandler(object):
@@ -13,10 +42,12 @@ class TestHandler(object):
     def test_parse(self):
         string = "@jake, jake.com is up. (thumbsup)"
 
-        def mock_get(url, timeout):
-            return mock.Mock(text="<title>Jake</title>")
+        def mock_get(url, **kwargs):
+            return mock.Mock(
+                headers={'Content-Type': 'text/html'},
+                iter_content=lambda size: [b"<title>Jake</title>"])
 
-        with mock.patch('requests.get', mock_get):
+        with patch_get(mock_get):
             data = self.handler.parse(string)
 
         expected_data = {
@@ -44,14 +75,634 @@ class TestHandler(object):
         self.handler.serialize(data)
 
 
+class TestParseStream(object):
+    def setup_method(self, method):
+        self.handler = Handler()
+
+    def slow_fetch_title(self, url):
+        if url == 'http://slow.com':
+            time.sleep(0.2)
+        return url
+
+    def test_ordered(self):
+        lines = ["@finn slow.com", "@jake", "(bmo)"]
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            data = list(self.handler.parse_stream(lines))
+
+        assert data == [
+            {'mentions': ['finn'],
+             'links': [{'url': 'slow.com', 'title': 'http://slow.com'}]},
+            {'mentions': ['jake']},
+            {'emoticons': ['bmo']},
+        ]
+
+    def test_unordered(self):
+        """Slow links don't hold up the messages behind them."""
+        lines = ["@finn slow.com", "@jake"]
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            data = list(self.handler.parse_stream(lines, ordered=False))
+
+        assert data[0] == {'mentions': ['jake']}
+        assert data[1]['mentions'] == ['finn']
+
+    def test_window(self):
+        lines = ["@finn {}".format(i) for i in range(10)]
+        data = list(self.handler.parse_stream(lines, window=2))
+        assert data == [{'mentions': ['finn']}] * 10
+
+    def test_empty(self):
+        assert list(self.handler.parse_stream([])) == []
+
+    def test_reader_error(self):
+        def lines():
+            yield "@finn"
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            list(self.handler.parse_stream(lines()))
+
+
+class TestParseMany(object):
+    def setup_method(self, method):
+        self.handler = Handler()
+        self.fetched = []
+
+    def counting_fetch_title(self, url):
+        self.fetched.append(url)
+        time.sleep(0.05)
+        return url.upper()
+
+    def test_parse_many(self):
+        strings = ["@finn finn.com", "(bmo)", "@jake jake.com finn.com"]
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.counting_fetch_title):
+            data = list(self.handler.parse_many(strings))
+
+        assert data == [
+            {'mentions': ['finn'],
+             'links': [{'url': 'finn.com', 'title': 'HTTP://FINN.COM'}]},
+            {'emoticons': ['bmo']},
+            {'mentions': ['jake'],
+             'links': [{'url': 'jake.com', 'title': 'HTTP://JAKE.COM'},
+                       {'url': 'finn.com', 'title': 'HTTP://FINN.COM'}]},
+        ]
+
+    def test_fetches_each_url_once(self):
+        strings = ["finn.com jake.com finn.com"] * 20
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.counting_fetch_title):
+            data = list(self.handler.parse_many(strings))
+
+        assert sorted(self.fetched) == ['http://finn.com', 'http://jake.com']
+        assert len(data) == 20
+        assert data[0]['links'][2] == {
+            'url': 'finn.com', 'title': 'HTTP://FINN.COM'}
+
+    def test_batches_are_separate(self):
+        self.handler.parsers['links'].title_cache = None
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.counting_fetch_title):
+            list(self.handler.parse_many(["finn.com"]))
+            list(self.handler.parse_many(["finn.com"]))
+
+        assert self.fetched == ['http://finn.com', 'http://finn.com']
+        assert self.handler.parsers['links'].batch_titles is None
+
+    def test_is_lazy(self):
+        """Only a window of messages is read ahead."""
+        read = []
+
+        def strings():
+            for i in range(1000):
+                read.append(i)
+                yield "@finn"
+
+        results = self.handler.parse_many(strings(), window=2)
+        assert next(results) == {'mentions': ['finn']}
+        time.sleep(0.1)
+        assert len(read) <= 4
+
+    def test_parse_many_function(self):
+        strings = list(parse_many(["@finn", "@jake"]))
+        assert [json.loads(s) for s in strings] == [
+            {'mentions': ['finn']}, {'mentions': ['jake']}]
+
+
+class TestScan(object):
+    def setup_method(self, method):
+        self.handler = Handler()
+
+    def test_scan_leaves_links_unresolved(self):
+        data = self.handler.scan("@jake, jake.com is up. (thumbsup)")
+        assert data == {
+            'mentions': ['jake'],
+            'emoticons': ['thumbsup'],
+            'links': ['jake.com'],
+        }
+
+    def test_invalid_ipv6_link(self):
+        """Links urlparse can't split don't fail the message."""
+        with patch_get(lambda url, **kwargs: mock_page(b"")):
+            data = Handler().parse("see [@a.com now")
+        assert data == {
+            'mentions': ['a'], 'links': [{'url': '[@a.com', 'title': ''}]}
+
+    def test_scan_batch(self):
+        assert self.handler.scan_batch(STRINGS) == [
+            self.handler.scan(string) for string in STRINGS]
+        assert self.handler.scan_batch([]) == []
+
+    def test_scan_batch_unjoinable(self):
+        """Parsers that can't scan a joined batch scan each message."""
+        class HashtagHandler(Handler):
+            parser_classes = dict(
+                Handler.parser_classes,
+                hashtags='tests.test_scanners.HashtagParser')
+
+        handler = HashtagHandler()
+        handler.parsers['links'].scan_budget = 1
+        strings = STRINGS + ["#finn @jake finn.com", "#jake"]
+        assert handler.scan_batch(strings) == [
+            handler.scan(string) for string in strings]
+
+    def test_resolve(self):
+        data = self.handler.scan("@jake, jake.com is up.")
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: 'Jake'):
+            data = self.handler.resolve(data)
+        assert data == {
+            'mentions': ['jake'],
+            'links': [{'url': 'jake.com', 'title': 'Jake'}],
+        }
+
+
+class TestTimeout(object):
+    def setup_method(self, method):
+        # slow.com's fetch doesn't finish until the test is over.
+        self.release = threading.Event()
+
+    def teardown_method(self, method):
+        self.release.set()
+
+    def slow_fetch_title(self, url):
+        if url == 'http://slow.com':
+            self.release.wait(5)
+        return url
+
+    def test_parse(self):
+        handler = Handler()
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            data = handler.parse("@finn slow.com fast.com", timeout=0.5)
+
+        assert data == {
+            'mentions': ['finn'],
+            'links': [{'url': 'slow.com', 'title': None},
+                      {'url': 'fast.com', 'title': 'http://fast.com'}],
+        }
+
+    def test_parse_function(self):
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            string = parse("slow.com", timeout=0.05)
+        assert json.loads(string) == {
+            'links': [{'url': 'slow.com', 'title': None}]}
+
+    def test_each_message_gets_the_timeout(self):
+        handler = Handler()
+        lines = ["slow.com", "fast.com slow.com", "@jake"]
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            data = list(handler.parse_many(lines, timeout=0.5))
+        assert data == [
+            {'links': [{'url': 'slow.com', 'title': None}]},
+            {'links': [{'url': 'fast.com', 'title': 'http://fast.com'},
+                       {'url': 'slow.com', 'title': None}]},
+            {'mentions': ['jake']},
+        ]
+
+
+class TestParseDeferred(object):
+    def setup_method(self, method):
+        self.handler = Handler()
+
+    def slow_fetch_title(self, url):
+        if url == 'http://slow.com':
+            time.sleep(0.2)
+        return url.upper()
+
+    def test_returns_before_titles(self):
+        release = threading.Event()
+
+        def blocked_fetch_title(url):
+            release.wait(5)
+            return url.upper()
+
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        blocked_fetch_title):
+            data, titles = self.handler.parse_deferred("@finn slow.com")
+            assert not titles.done()
+            release.set()
+            assert data == {
+                'mentions': ['finn'],
+                'links': [{'url': 'slow.com', 'title': None}],
+            }
+            assert titles.result() == {
+                'mentions': ['finn'],
+                'links': [{'url': 'slow.com', 'title': 'HTTP://SLOW.COM'}],
+            }
+
+    def test_callback(self):
+        delivered = []
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            data, titles = self.handler.parse_deferred("slow.com jake.com")
+            titles.add_callback(lambda *args: delivered.append(args))
+            titles.result()
+
+        # Each title is delivered as soon as it's fetched.
+        assert delivered == [
+            ('links', 1, 'jake.com', 'HTTP://JAKE.COM'),
+            ('links', 0, 'slow.com', 'HTTP://SLOW.COM'),
+        ]
+
+    def test_cached_titles_are_done(self):
+        title_cache = self.handler.parsers['links'].title_cache
+        title_cache.set('http://jake.com', 'Jake')
+        data, titles = self.handler.parse_deferred("jake.com")
+        assert titles.done()
+        assert titles.result(timeout=0)['links'] == [
+            {'url': 'jake.com', 'title': 'Jake'}]
+
+    def test_no_links(self):
+        data, titles = self.handler.parse_deferred("@finn")
+        assert data == {'mentions': ['finn']}
+        assert titles.done()
+        assert titles.result() == data
+
+    def test_stream(self):
+        lines = ["slow.com @finn", "(bmo)", "jake.com slow.com"]
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        self.slow_fetch_title):
+            records = list(self.handler.parse_deferred_stream(lines))
+
+        messages = [r for r in records if 'key' not in r]
+        titles = [r for r in records if 'key' in r]
+        assert messages == [
+            {'line': 1, 'mentions': ['finn'],
+             'links': [{'url': 'slow.com', 'title': None}]},
+            {'line': 2, 'emoticons': ['bmo']},
+            {'line': 3, 'links': [{'url': 'jake.com', 'title': None},
+                                  {'url': 'slow.com', 'title': None}]},
+        ]
+        # Every message comes before the slow titles.
+        assert records[:3] == messages
+        assert sorted((r['line'], r['index'], r['title']) for r in titles) == [
+            (1, 0, 'HTTP://SLOW.COM'), (3, 0, 'HTTP://JAKE.COM'),
+            (3, 1, 'HTTP://SLOW.COM')]
+
+    def test_stream_forgets_finished_fetches(self):
+        lines = ["finn{}.com".format(i) for i in range(100)]
+        with recording_batches() as batches, \
+                mock.patch('chat_parser.parsers.fetch_title', lambda url: ''):
+            records = list(self.handler.parse_deferred_stream(lines))
+            parsers.shutdown()
+
+        assert len(records) == 200
+        assert [len(batch.batch_titles) for batch in batches] == [0]
+
+    def test_stream_window(self):
+        lines = ["jake{}.com".format(i) for i in range(20)]
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: url):
+            records = list(
+                self.handler.parse_deferred_stream(lines, window=2))
+        assert len(records) == 40
+
+    def test_failed_fetch(self):
+        """A fetch that raises delivers '' rather than stalling the stream."""
+        def failing_fetch_title(url):
+            raise ValueError(url)
+
+        records = []
+
+        def read():
+            records.extend(self.handler.parse_deferred_stream(["finn.com"]))
+
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        failing_fetch_title):
+            reader = threading.Thread(target=read)
+            reader.daemon = True
+            reader.start()
+            reader.join(5)
+
+        assert not reader.is_alive()
+        assert records[1] == {
+            'line': 1, 'key': 'links', 'index': 0, 'url': 'finn.com',
+            'title': ''}
+
+    def test_failed_fetch_result(self):
+        def failing_fetch_title(url):
+            raise ValueError(url)
+
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        failing_fetch_title):
+            data, titles = self.handler.parse_deferred("finn.com")
+            assert titles.result(5) == {
+                'links': [{'url': 'finn.com', 'title': ''}]}
+
+
+class TestNoTitles(object):
+    string = "@finn finn.com"
+    expected = {'mentions': ['finn'],
+                'links': [{'url': 'finn.com', 'title': None}]}
+
+    def test_parse(self):
+        fetch = mock.Mock()
+        with mock.patch('chat_parser.parsers.fetch_title', fetch):
+            data = Handler(titles=False).parse(self.string)
+
+        assert data == self.expected
+        assert not fetch.called
+
+    def test_parse_deferred(self):
+        data, titles = Handler(titles=False).parse_deferred(self.string)
+        assert data == self.expected
+        assert titles.done()
+
+    def test_parse_function(self):
+        assert json.loads(parse(self.string, titles=False)) == self.expected
+
+    def test_imports_no_network_libraries(self):
+        code = (
+            "import sys\n"
+            "from chat_parser import parse\n"
+            "parse('@finn finn.com', titles=False)\n"
+            "print(sorted(set(sys.modules) & {'requests', 'lxml', 'sqlite3'}))"
+        )
+        output = subprocess.check_output([sys.executable, '-c', code])
+        assert output.strip() == b'[]'
+
+
+class TestIncrementalParser(object):
+    def setup_method(self, method):
+        self.handler = Handler(titles=False)
+
+    def feed_all(self, chunks):
+        parser = self.handler.incremental()
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+
+    def assert_same(self, data, string):
+        expected = self.handler.parse(string)
+        for key in ('mentions', 'emoticons'):
+            if key in data:
+                data[key] = sorted(data[key])
+                expected[key] = sorted(expected[key])
+        assert data == expected, string
+
+    def test_split_tokens(self):
+        string = "hi @jake see (thumbsup) at http://jake.com/a?b ok"
+        for split in range(len(string) + 1):
+            data = self.feed_all([string[:split], string[split:]])
+            self.assert_same(data, string)
+
+    def test_same_as_parse(self):
+        rand = random.Random(0)
+        for string in STRINGS:
+            chunks = []
+            start = 0
+            while start < len(string):
+                end = start + rand.randint(1, 8)
+                chunks.append(string[start:end])
+                start = end
+            self.assert_same(self.feed_all(chunks), string)
+
+    def test_feed_returns_completed_tokens(self):
+        parser = self.handler.incremental()
+        assert parser.feed("@ja") == {}
+        assert parser.feed("ke (bm") == {'mentions': ['jake']}
+        assert parser.feed("o) jake.com") == {'emoticons': ['bmo']}
+        assert parser.close() == {
+            'mentions': ['jake'],
+            'emoticons': ['bmo'],
+            'links': [{'url': 'jake.com', 'title': None}],
+        }
+
+    def test_bytes(self):
+        encoded = "@jake ✪ (bmo)".encode('utf-8')
+        chunks = [encoded[i:i + 1] for i in range(len(encoded))]
+        data = self.feed_all(chunks)
+        assert data == {'mentions': ['jake'], 'emoticons': ['bmo']}
+
+    def test_empty(self):
+        assert self.feed_all([]) == {}
+        assert self.feed_all(['', '  ']) == {}
+
+    def test_fetches_titles_before_close(self):
+        fetched = []
+
+        def fetch_title(url):
+            fetched.append(url)
+            return 'Jake'
+
+        with mock.patch('chat_parser.parsers.fetch_title', fetch_title):
+            parser = Handler().incremental()
+            parser.feed("jake.com ")
+            parsers.LinkParser.scheduler().shutdown()
+            assert fetched == ['http://jake.com']
+            data = parser.close()
+
+        assert data == {'links': [{'url': 'jake.com', 'title': 'Jake'}]}
+
+    def test_close_reuses_fetches(self):
+        fetched = []
+
+        def fetch_title(url):
+            fetched.append(url)
+            return 'Jake'
+
+        handler = Handler()
+        handler.parsers['links'].title_cache = None
+        with mock.patch('chat_parser.parsers.fetch_title', fetch_title):
+            parser = handler.incremental()
+            parser.feed("jake.com ")
+            # The first fetch has finished before the link is seen again.
+            parsers.shutdown()
+            parser.feed("JAKE.com ")
+            data = parser.close(timeout=5)
+
+        assert fetched == ['http://jake.com']
+        assert data == {'links': [
+            {'url': 'jake.com', 'title': 'Jake'},
+            {'url': 'JAKE.com', 'title': 'Jake'},
+        ]}
+
+
+class TestParserClasses(object):
+    def test_dotted_path(self):
+        class LazyHandler(Handler):
+            parser_classes = {'mentions': 'chat_parser.parsers.MentionParser'}
+
+        handler = LazyHandler()
+        assert isinstance(handler.parsers['mentions'], parsers.MentionParser)
+        assert handler.parse("@finn (bmo)") == {'mentions': ['finn']}
+
+
+class TestParseParallel(object):
+    def test_parse_parallel(self):
+        strings = [
+            "@finn{} finn.com (bmo) jake{}.com".format(i, i % 3)
+            for i in range(50)
+        ]
+        handler = Handler()
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: url):
+            data = list(handler.parse_parallel(
+                strings, workers=2, chunk_size=7))
+            expected = [handler.parse(string) for string in strings]
+
+        assert data == expected
+
+    def test_fetches_each_url_once(self):
+        fetched = []
+
+        def counting_fetch_title(url):
+            fetched.append(url)
+            return url
+
+        handler = Handler()
+        strings = ["finn.com jake.com"] * 10
+        with mock.patch('chat_parser.parsers.fetch_title',
+                        counting_fetch_title):
+            list(handler.parse_parallel(strings, workers=2, chunk_size=3))
+
+        assert sorted(fetched) == ['http://finn.com', 'http://jake.com']
+
+    def test_forgets_finished_fetches(self):
+        """A year of chat doesn't keep a fetch per distinct link."""
+        strings = ["finn{}.com".format(i) for i in range(100)]
+        with recording_batches() as batches, \
+                mock.patch('chat_parser.parsers.fetch_title', lambda url: ''):
+            data = list(Handler().parse_parallel(
+                strings, workers=2, chunk_size=10))
+            parsers.shutdown()
+
+        assert len(data) == 100
+        assert [len(batch.batch_titles) for batch in batches] == [0]
+
+    def test_parse_parallel_function(self):
+        strings = list(parse_parallel(["@finn", "@jake"], workers=2))
+        assert [json.loads(s) for s in strings] == [
+            {'mentions': ['finn']}, {'mentions': ['jake']}]
+
+
+class TestScanFile(object):
+    lines = [
+        "@jake, jake.com is up. (thumbsup)",
+        "",
+        "http://✪df.ws/123 (mathematical123) @Finn",
+        "  finn.com jake@adventuretime.com",
+        "http://foo.com/blah_(wikipedia) @ic3_k!ng",
+        "nothing to see here",
+    ]
+
+    def write(self, tmpdir, text):
+        path = tmpdir.join('chat.log')
+        path.write_binary(text.encode('utf-8'))
+        return str(path)
+
+    def test_same_as_scan(self, tmpdir):
+        path = self.write(tmpdir, "\n".join(self.lines) + "\n")
+        handler = Handler()
+        expected = [handler.scan(line) for line in self.lines]
+
+        assert list(handler.scan_file(path)) == expected
+
+    def test_non_ascii_mentions(self, tmpdir):
+        """`\\w` is only ASCII in bytes, so mentions aren't byte scanned."""
+        path = self.write(tmpdir, "@josé @Zoë\n")
+        handler = Handler()
+        data, = handler.scan_file(path)
+        assert sorted(data['mentions']) == sorted(
+            handler.scan("@josé @Zoë")['mentions'])
+
+    def test_small_blocks(self, tmpdir):
+        """Lines aren't split or dropped between blocks."""
+        path = self.write(tmpdir, "\n".join(self.lines))
+        handler = Handler()
+        expected = [handler.scan(line) for line in self.lines]
+
+        assert list(handler.scan_file(path, block_size=10)) == expected
+
+    def test_empty_file(self, tmpdir):
+        path = self.write(tmpdir, "")
+        assert list(Handler().scan_file(path)) == []
+
+    def test_parser_without_byte_regex(self, tmpdir):
+        class CustomParser(parsers.Parser):
+            def parse(self, string):
+                return string.split()[:1]
+
+        handler = Handler()
+        handler.parsers['custom'] = CustomParser()
+        path = self.write(tmpdir, "\n".join(self.lines))
+
+        custom = [data.get('custom') for data in handler.scan_file(path)]
+        assert custom[0] == ['@jake,']
+        assert custom[1] is None
+
+    def test_links_scanned_as_bytes(self, tmpdir):
+        """Links are found in the mapped bytes, not in decoded lines."""
+        path = self.write(tmpdir, "\n".join(self.lines))
+        handler = Handler()
+        expected = [handler.scan(line) for line in self.lines]
+
+        with mock.patch('chat_parser.tokenizers.find_urls') as find_urls:
+            assert list(handler.scan_file(path)) == expected
+        assert not find_urls.called
+
+    def test_link_budget(self, tmpdir):
+        """A budget is per line, so those lines are decoded."""
+        path = self.write(tmpdir, "\n".join(self.lines))
+        handler = Handler()
+        handler.parsers['links'].scan_budget = 10
+
+        links = [data.get('links') for data in handler.scan_file(path)]
+        assert links[0] == ['jake.com']
+
+    def test_parse_file(self, tmpdir):
+        path = self.write(tmpdir, "@finn finn.com\n(bmo)\n")
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: 'Finn'):
+            data = list(Handler().parse_file(path))
+
+        assert data == [
+            {'mentions': ['finn'],
+             'links': [{'url': 'finn.com', 'title': 'Finn'}]},
+            {'emoticons': ['bmo']},
+        ]
+
+    def test_parse_file_forgets_finished_fetches(self, tmpdir):
+        lines = ["finn{}.com".format(i) for i in range(100)]
+        path = self.write(tmpdir, "\n".join(lines))
+        with recording_batches() as batches, \
+                mock.patch('chat_parser.parsers.fetch_title', lambda url: ''):
+            assert len(list(Handler().parse_file(path))) == 100
+            parsers.shutdown()
+
+        assert [len(batch.batch_titles) for batch in batches] == [0]
+
+
 class TestParseFunction(object):
     def test_parse(self):
         string = "@jake, jake.com is up. (thumbsup)"
 
-        def mock_get(url, timeout):
-            return mock.Mock(text="<title>Jake</title>")
+        def mock_get(url, **kwargs):
+            return mock.Mock(
+                headers={'Content-Type': 'text/html'},
+                iter_content=lambda size: [b"<title>Jake</title>"])
 
-        with mock.patch('requests.get', mock_get):
+        with patch_get(mock_get):
             string = parse(string)
 
         data = json.loads(string)
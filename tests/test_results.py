@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import mock
+import pytest
+
+from chat_parser.handlers import Handler
+from chat_parser import results
+from chat_parser.results import Link, Result, intern_string
+from chat_parser.serializers import (
+    BinarySerializer, CompactJSONSerializer, JSONSerializer)
+
+DATA = {
+    'mentions': ['finn', 'jake'],
+    'emoticons': ['bmo'],
+    'links': [{'url': 'finn.com', 'title': 'Finn'}],
+}
+
+
+class TestResult(object):
+    def test_round_trip(self):
+        result = Result.from_dict(DATA)
+        assert result.mentions == ('finn', 'jake')
+        assert result.links == (Link('finn.com', 'Finn'),)
+        assert result.to_dict() == DATA
+
+    def test_missing_keys(self):
+        result = Result.from_dict({'emoticons': ['bmo']})
+        assert result.mentions == ()
+        assert result.to_dict() == {'emoticons': ['bmo']}
+
+    def test_extra_keys(self):
+        data = {'mentions': ['finn'], 'custom': ['@finn,']}
+        result = Result.from_dict(data)
+        assert result.extra == {'custom': ['@finn,']}
+        assert result.to_dict() == data
+
+    def test_strings_are_interned(self):
+        first = Result.from_dict({'mentions': [''.join(['fi', 'nn'])]})
+        second = Result.from_dict({'mentions': [''.join(['fin', 'n'])]})
+        assert first.mentions[0] is second.mentions[0]
+        assert intern_string(''.join(['f', 'inn'])) is first.mentions[0]
+
+    def test_intern_table_is_bounded(self):
+        with mock.patch.object(results, 'MAX_STRINGS', 3):
+            for i in range(10):
+                intern_string('finn{}'.format(i))
+                assert len(results._strings) <= 3
+        assert intern_string('finn9') == 'finn9'
+
+    def test_equality(self):
+        assert Result.from_dict(DATA) == DATA
+        assert Result.from_dict(DATA) == Result.from_dict(DATA)
+        assert Result.from_dict(DATA) != {}
+
+    def test_slots(self):
+        with pytest.raises(AttributeError):
+            Result().other = 1
+
+
+class TestSerializers(object):
+    @pytest.mark.parametrize('serializer_class', [
+        JSONSerializer, CompactJSONSerializer])
+    def test_json(self, serializer_class):
+        serialized = serializer_class().serialize(Result.from_dict(DATA))
+        assert json.loads(serialized) == DATA
+
+    def test_binary(self):
+        serializer = BinarySerializer()
+        serialized = serializer.serialize(Result.from_dict(DATA))
+        assert serializer.deserialize(serialized) == DATA
+
+    def test_unsupported(self):
+        with pytest.raises(TypeError):
+            JSONSerializer().serialize(object())
+
+
+class TestCompactHandler(object):
+    string = "@jake, jake.com is up. (thumbsup)"
+
+    def test_parse(self):
+        with mock.patch('chat_parser.parsers.fetch_title', lambda url: 'Jake'):
+            result = Handler(compact=True).parse(self.string)
+
+        assert isinstance(result, Result)
+        assert result == {
+            'mentions': ['jake'],
+            'emoticons': ['thumbsup'],
+            'links': [{'url': 'jake.com', 'title': 'Jake'}],
+        }
+
+    def test_parse_many(self):
+        handler = Handler(titles=False, compact=True)
+        data = list(handler.parse_many([self.string, "(bmo)"]))
+        assert all(isinstance(result, Result) for result in data)
+        assert data[1] == {'emoticons': ['bmo']}
@@ -1,6 +1,17 @@
+# -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from chat_parser.serializers import JSONSerializer
+import io
+import json
+import subprocess
+import sys
+
+import pytest
+
+from chat_parser.handlers import Handler, parse
+from chat_parser.serializers import (
+    BinarySerializer, CompactJSONSerializer, JSONSerializer,
+    NDJSONSerializer, get_serializer_class)
 
 
 class TestJSONSerializer(object):
@@ -16,3 +27,111 @@ class TestJSONSerializer(object):
         # JSON encoding has non deterministic ordering.
         # Verify the encoder doesn't raise any exceptions
         JSONSerializer().serialize(data)
+
+
+class TestCompactJSONSerializer(object):
+    def test_serializer(self):
+        data = {'mentions': ['jake'], 'emoticons': ['bmo']}
+        string = CompactJSONSerializer().serialize(data)
+        assert ' ' not in string
+        assert json.loads(string) == data
+
+
+class TestNDJSONSerializer(object):
+    def test_serializer(self):
+        """Verifies output is compact and on a single line."""
+        data = {
+            'mentions': ['jake'],
+            'link': [
+                {'url': 'lumpyspace.com', 'title': "What the Lump!"},
+            ]
+        }
+        string = NDJSONSerializer().serialize(data)
+        assert '\n' not in string
+        assert ', ' not in string
+        assert json.loads(string) == data
+
+    def test_dump(self):
+        records = [{'mentions': ['jake']}, {'emoticons': ['bmo']}]
+        f = io.StringIO() if str is not bytes else io.BytesIO()
+        serializer = NDJSONSerializer()
+        for data in records:
+            serializer.dump(data, f)
+
+        lines = f.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == records
+
+
+class TestBinarySerializer(object):
+    data = {
+        'mentions': ['jake', 'ünicorn'],
+        'links': [{'url': 'lumpyspace.com', 'title': None}],
+        'line': 300,
+        'offset': -7,
+        'score': 0.5,
+        'flags': [True, False],
+    }
+
+    def test_round_trip(self):
+        serializer = BinarySerializer()
+        assert serializer.deserialize(serializer.serialize(self.data)) == \
+            self.data
+
+    def test_smaller_than_json(self):
+        data = {'mentions': ['jake'], 'emoticons': ['bmo', 'success']}
+        assert len(BinarySerializer().serialize(data)) < \
+            len(CompactJSONSerializer().serialize(data))
+
+    def test_read_records(self):
+        serializer = BinarySerializer()
+        f = io.BytesIO()
+        for i in range(3):
+            serializer.dump(dict(self.data, line=i), f)
+        f.seek(0)
+
+        records = list(serializer.read_records(f))
+        assert [r['line'] for r in records] == [0, 1, 2]
+        assert records[0] == dict(self.data, line=0)
+
+    def test_truncated(self):
+        serializer = BinarySerializer()
+        frame = serializer.serialize(self.data)
+        with pytest.raises(ValueError):
+            list(serializer.read_records(io.BytesIO(frame[:-1])))
+        with pytest.raises(ValueError):
+            serializer.deserialize(frame[:-1])
+
+    def test_unsupported(self):
+        with pytest.raises(TypeError):
+            BinarySerializer().serialize({'mentions': object()})
+
+
+class TestFormats(object):
+    def test_get_serializer_class(self):
+        assert get_serializer_class('json') is JSONSerializer
+        assert get_serializer_class('binary') is BinarySerializer
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            get_serializer_class('yaml')
+
+    def test_handler_serialize(self):
+        handler = Handler()
+        data = {'mentions': ['jake']}
+        assert handler.serialize(data) == JSONSerializer().serialize(data)
+        assert handler.serialize(data, 'compact') == '{"mentions":["jake"]}'
+
+    def test_parse_format(self):
+        assert parse("@jake", format='compact') == '{"mentions":["jake"]}'
+        string = parse("@jake", format='binary')
+        assert BinarySerializer().deserialize(string) == {
+            'mentions': ['jake']}
+
+    def test_command_line_binary(self):
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'chat_parser.main', '--format', 'binary'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output, _ = process.communicate(b"@jake (bmo)")
+        assert process.returncode == 0
+        assert BinarySerializer().deserialize(output) == {
+            'mentions': ['jake'], 'emoticons': ['bmo']}
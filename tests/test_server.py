@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+import socket
+import threading
+
+import mock
+import pytest
+import requests
+
+from chat_parser.serializers import BinarySerializer
+from chat_parser.server import ParseServer, UnixParseServer
+
+
+def start(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def server():
+    server = start(ParseServer(('127.0.0.1', 0)))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_title(url):
+    return 'Finn'
+
+
+class TestParseServer(object):
+    def test_parse(self, server):
+        with mock.patch('chat_parser.parsers.fetch_title', fetch_title):
+            response = requests.post(
+                server.base_url + '/parse',
+                data="@finn (bmo) finn.com ✪".encode('utf-8'))
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'application/json'
+        assert response.json() == {
+            'mentions': ['finn'],
+            'emoticons': ['bmo'],
+            'links': [{'url': 'finn.com', 'title': 'Finn'}],
+        }
+
+    def test_batch(self, server):
+        fetch = mock.Mock(return_value='Finn')
+        with mock.patch('chat_parser.parsers.fetch_title', fetch):
+            response = requests.post(
+                server.base_url + '/batch',
+                data="@finn finn.com\n(bmo)\n\nfinn.com")
+
+        records = [json.loads(line) for line in response.text.splitlines()]
+        assert records == [
+            {'mentions': ['finn'],
+             'links': [{'url': 'finn.com', 'title': 'Finn'}]},
+            {'emoticons': ['bmo']},
+            {},
+            {'links': [{'url': 'finn.com', 'title': 'Finn'}]},
+        ]
+        assert fetch.call_count == 1
+
+    def test_batch_lines(self, server):
+        """Only newlines separate messages, as on the command line."""
+        response = requests.post(
+            server.base_url + '/batch',
+            data="@finn\x0b@jake\u2028(bmo)\n@bmo\n".encode('utf-8'))
+        records = [json.loads(line) for line in response.text.split('\n')
+                   if line]
+        assert len(records) == 2
+        assert records[1] == {'mentions': ['bmo']}
+
+    def test_format(self, server):
+        response = requests.post(
+            server.base_url + '/parse?format=binary', data="@finn")
+        assert BinarySerializer().deserialize(response.content) == {
+            'mentions': ['finn']}
+
+    def test_no_titles(self, server):
+        fetch = mock.Mock()
+        with mock.patch('chat_parser.parsers.fetch_title', fetch):
+            response = requests.post(
+                server.base_url + '/parse?titles=0', data="finn.com")
+
+        assert response.json() == {
+            'links': [{'url': 'finn.com', 'title': None}]}
+        assert not fetch.called
+
+    @pytest.mark.parametrize('path, status', [
+        ('/parse?format=yaml', 400),
+        ('/parse?timeout=soon', 400),
+        ('/other', 404),
+    ])
+    def test_bad_requests(self, server, path, status):
+        response = requests.post(server.base_url + path, data="@finn")
+        assert response.status_code == status
+
+    def test_parse_error(self, server):
+        """Unexpected errors get a 500, and the connection stays usable."""
+        session = requests.Session()
+        with mock.patch.object(server.handlers[True], 'parse',
+                               side_effect=ValueError("boom")):
+            response = session.post(server.base_url + '/parse', data="x")
+        assert response.status_code == 500
+
+        response = session.post(server.base_url + '/parse', data="@finn")
+        assert response.json() == {'mentions': ['finn']}
+
+    def test_keeps_connections_alive(self, server):
+        session = requests.Session()
+        for i in range(3):
+            response = session.post(server.base_url + '/parse', data="@finn")
+            assert response.json() == {'mentions': ['finn']}
+
+
+class TestBackpressure(object):
+    def test_full_queue(self):
+        server = start(ParseServer(('127.0.0.1', 0), workers=1, queue_size=1))
+        started = threading.Event()
+        release = threading.Event()
+
+        def parse(string, timeout=None):
+            started.set()
+            release.wait(5)
+            return {}
+
+        statuses = []
+
+        def post():
+            response = requests.post(server.base_url + '/parse', data="x")
+            statuses.append(response.status_code)
+
+        try:
+            with mock.patch.object(server.handlers[True], 'parse', parse):
+                running = threading.Thread(target=post)
+                running.start()
+                started.wait(5)
+                queued = threading.Thread(target=post)
+                queued.start()
+                while not server.waiting:
+                    release.wait(0.01)
+
+                response = requests.post(server.base_url + '/parse', data="x")
+                assert response.status_code == 503
+                assert response.headers['Retry-After'] == '1'
+
+                # Turned away before its body is read: this one never
+                # sends it.
+                client = socket.create_connection(server.server_address, 5)
+                client.sendall(b"POST /parse HTTP/1.1\r\nHost: x\r\n"
+                               b"Content-Length: 1000\r\n\r\n")
+                reply = client.makefile('rb').read()
+                client.close()
+                assert reply.startswith(b"HTTP/1.1 503 ")
+                assert b"Connection: close" in reply
+
+                release.set()
+                running.join()
+                queued.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert statuses == [200, 200]
+
+
+class TestUnixParseServer(object):
+    def test_parse(self, tmpdir):
+        path = str(tmpdir.join('chatparse.sock'))
+        server = start(UnixParseServer(path))
+        try:
+            client = socket.socket(socket.AF_UNIX)
+            client.connect(path)
+            client.sendall(
+                b'POST /parse HTTP/1.1\r\n'
+                b'Host: localhost\r\n'
+                b'Content-Length: 5\r\n'
+                b'Connection: close\r\n'
+                b'\r\n'
+                b'@finn')
+            response = b''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200')
+        assert json.loads(body.decode('utf-8')) == {'mentions': ['finn']}
+        assert not os.path.exists(path)
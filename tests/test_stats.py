@@ -0,0 +1,129 @@
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from requests.exceptions import ConnectTimeout
+
+from chat_parser import parsers, stats
+from chat_parser.handlers import Handler
+from chat_parser.serializers import JSONSerializer
+
+from .test_parsers import mock_page, patch_get
+
+
+@pytest.fixture
+def recorder():
+    recorder = stats.Recorder()
+    recorder.install()
+    yield recorder
+    recorder.uninstall()
+
+
+class TestTimed(object):
+    def test_no_timers(self):
+        """Nothing is timed without a timer registered."""
+        @stats.timed('finn')
+        def func():
+            return 'finn'
+
+        with mock.patch('time.time', side_effect=AssertionError):
+            assert func() == 'finn'
+
+    def test_timer(self):
+        calls = []
+
+        @stats.timed('finn')
+        def func():
+            return 'finn'
+
+        timer = lambda *args: calls.append(args)
+        stats.add_timer(timer)
+        try:
+            assert func() == 'finn'
+        finally:
+            stats.remove_timer(timer)
+
+        assert len(calls) == 1
+        assert calls[0][0] == 'finn'
+
+    def test_class_name(self, recorder):
+        JSONSerializer().serialize({})
+        assert recorder.stages['serializer.JSONSerializer'].count == 1
+
+    def test_exceptions_are_timed(self, recorder):
+        @stats.timed('finn')
+        def func():
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            func()
+        assert recorder.stages['finn'].count == 1
+
+
+class TestHistogram(object):
+    def test_percentile(self):
+        histogram = stats.Histogram()
+        for i in range(99):
+            histogram.add(0.001)
+        histogram.add(1)
+
+        assert histogram.count == 100
+        assert histogram.percentile(0.5) == pytest.approx(0.0016, 0.1)
+        assert histogram.percentile(0.999) == 1
+        assert histogram.max == 1
+
+
+class TestRecorder(object):
+    def test_handler_stages(self, recorder):
+        Handler().parse("@finn (bmo)")
+        for stage in ['handler.parse', 'handler.scan', 'handler.resolve']:
+            assert recorder.stages[stage].count == 1
+
+    def test_parser_stage(self, recorder):
+        parsers.MentionParser().parse("@finn")
+        assert recorder.stages['parser.MentionParser'].count == 1
+
+    def test_fetch(self, recorder):
+        page = mock_page(b"<title>Finn</title>")
+        with patch_get(lambda url, **kwargs: page):
+            parsers.fetch_title("finn.com/ooo")
+
+        assert recorder.hosts[('fetch_title', 'finn.com')].count == 1
+        assert recorder.stages['fetch.connect'].count == 1
+        assert recorder.stages['fetch.read'].count == 1
+        assert recorder.counts['fetch.bytes'] == 19
+
+    def test_timer_added_during_fetch(self):
+        recorder = stats.Recorder()
+
+        def read_title(page, url, max_bytes):
+            recorder.install()
+            return 'Finn'
+
+        page = mock_page(b"<title>Finn</title>")
+        try:
+            with patch_get(lambda url, **kwargs: page), \
+                    mock.patch('chat_parser.parsers.read_title', read_title):
+                assert parsers.fetch_title("finn.com") == 'Finn'
+        finally:
+            recorder.uninstall()
+
+        assert recorder.stages['fetch.read'].count == 1
+
+    def test_fetch_timeout(self, recorder):
+        def timeout(url, **kwargs):
+            raise ConnectTimeout()
+
+        with patch_get(timeout):
+            parsers.fetch_title("finn.com")
+
+        assert recorder.counts['fetch.timeouts'] == 1
+        assert recorder.hosts[('fetch_title', 'finn.com')].count == 1
+
+    def test_report(self, recorder):
+        Handler().parse("@finn (bmo)")
+        recorder.counter('fetch.errors', 2, {})
+        report = recorder.report()
+
+        assert 'handler.parse' in report
+        assert 'fetch.errors' in report
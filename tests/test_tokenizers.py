@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+import time
+
+import mock
+
+from chat_parser import parsers, stats
+from chat_parser.tokenizers import BYTES, find_url_starts, find_urls
+
+from .test_scanners import STRINGS
+
+
+def regex_urls(string):
+    return [m.group(1) for m in parsers.LinkParser.regex.finditer(string)]
+
+
+def byte_urls(string):
+    data = string.encode('utf-8')
+    return [
+        (len(data[:start].decode('utf-8')), url.decode('utf-8'))
+        for start, url in find_url_starts(data, syntax=BYTES)
+    ]
+
+
+class TestFindUrls(object):
+    def test_same_as_regex(self):
+        for string in STRINGS:
+            assert find_urls(string) == regex_urls(string), string
+
+    def test_same_as_regex_on_random_strings(self):
+        pieces = list("aZh1t2p5sf0-.@:/ \n\t") + [
+            'é', '✪', 'http://', 'ftp://', '.com', '255', '10.0.0.1', '--',
+            ' www.', '@x',
+        ]
+        rand = random.Random(0)
+        for i in range(20000):
+            string = ''.join(
+                rand.choice(pieces) for j in range(rand.randint(0, 30)))
+            assert find_urls(string) == regex_urls(string), string
+
+    def test_bytes_same_as_text(self):
+        pieces = list("aZh1t2p5sf0-.@:/ \n\t") + [
+            'é', '✪', 'http://', '.com', '10.0.0.1', '--', '@x', 'é.com']
+        rand = random.Random(0)
+        strings = STRINGS + [
+            ''.join(rand.choice(pieces) for j in range(rand.randint(0, 30)))
+            for i in range(5000)
+        ]
+        for string in strings:
+            assert byte_urls(string) == find_url_starts(string), string
+
+    def test_bytes_range(self):
+        data = b"x finn.com jake.com/x"
+        assert find_url_starts(data, 2, 10, BYTES) == [(2, b"finn.com")]
+
+    def test_port(self):
+        assert find_urls("finn.com:8 finn.com:123456/x") == [
+            "finn.com", "finn.com:12345"]
+
+    def test_trailing_text(self):
+        """Like the regex, a link doesn't need whitespace after it."""
+        assert find_urls("finn.com_is_cool jake.com's") == [
+            "finn.com", "jake.com"]
+
+    def test_long_runs_are_linear(self):
+        """Four times the input takes about four times as long, not 16."""
+        def took(string):
+            times = []
+            for i in range(3):
+                start = time.time()
+                find_urls(string)
+                times.append(time.time() - start)
+            return min(times)
+
+        for make in [lambda n: 'a' * n, lambda n: 'a.' + '1' * n,
+                     lambda n: 'http://' + 'a-' * (n // 2),
+                     lambda n: '@a' * (n // 2) + '.']:
+            small = took(make(25000))
+            large = took(make(100000))
+            assert large < 8 * max(small, 0.001), make(10)
+
+    def test_bytes(self):
+        """Byte strings, as Python 2 reads stdin, are taken as utf-8."""
+        string = "@finn j aime le café. café.com".encode('utf-8')
+        assert find_urls(string) == ["café.com".encode('utf-8')]
+
+    def test_budget(self):
+        counts = []
+
+        def counter(*args):
+            counts.append(args)
+
+        stats.add_counter(counter)
+        try:
+            string = "finn.com jake.com bmo.com"
+            with mock.patch('chat_parser.tokenizers.time') as clock:
+                clock.time.side_effect = [0, 0, 0.5, 2]
+                assert find_urls(string, budget=1) == ["finn.com", "jake.com"]
+        finally:
+            stats.remove_counter(counter)
+        assert counts == [('links.budget_exceeded', 1, {})]
+
+    def test_link_parser_budget(self):
+        parser = parsers.LinkParser()
+        parser.scan_budget = 0
+        assert parser.matches("finn.com jake.com") == []